@@ -23,23 +23,70 @@ import pyarrow as pa
 from paddle.io import Dataset
 from paddle.vision.transforms import (
     Compose,
-    Normalize,
     RandomHorizontalFlip,
     RandomResizedCrop,
     Resize,
-    ToTensor,
 )
 from PIL import Image
 
+IMAGE_MEAN = [0.485, 0.456, 0.406]
+IMAGE_STD = [0.229, 0.224, 0.225]
+
 
 def _convert_to_rgb(image):
     return image.convert("RGB")
 
 
+class _ResizeIfNeeded(Resize):
+    """
+    `Resize` that returns PIL images already at the target (h, w) untouched instead of resampling them.
+    """
+
+    def _apply_image(self, img):
+        if isinstance(img, Image.Image) and isinstance(self.size, (list, tuple)):
+            if img.size == (self.size[1], self.size[0]):
+                return img
+        return super()._apply_image(img)
+
+
+class _ToNormalizedArray(object):
+    """
+    Fused replacement of `ToTensor()` + `Normalize(mean, std)`: `(x / 255 - mean) / std` is folded
+    into a single `x * scale + bias` pass that reads the uint8 HWC image once and writes float32 CHW.
+    """
+
+    def __init__(self, mean, std):
+        mean = np.asarray(mean, dtype=np.float32)
+        std = np.asarray(std, dtype=np.float32)
+        self.scale = 1.0 / (255.0 * std)
+        self.bias = -mean / std
+
+    def __call__(self, image):
+        image = np.asarray(image, dtype=np.float32)
+        image *= self.scale
+        image += self.bias
+        return image.transpose((2, 0, 1))
+
+
+def _open_arrow_table(arrow_filename):
+    # Memory-map the arrow file so that rows are read zero-copy on demand
+    return pa.ipc.open_file(pa.memory_map(arrow_filename, "r")).read_all()
+
+
+def _open_image(image_bytes, resolution):
+    image = Image.open(BytesIO(image_bytes))
+    # Let libjpeg decode large JPEGs at a reduced DCT scale, keeping a 2x margin over the target resolution
+    if image.format == "JPEG":
+        image.draft("RGB", (resolution * 2, resolution * 2))
+    return image
+
+
+_QUOTE_TABLE = str.maketrans({"“": '"', "”": '"'})
+
+
 def _preprocess_text(text):
     # Adapt the text to Chinese BERT vocab
-    text = text.lower().replace("“", '"').replace("”", '"')
-    return text
+    return text.translate(_QUOTE_TABLE).lower()
 
 
 class ArrowDataset(Dataset):
@@ -59,10 +106,10 @@ class ArrowDataset(Dataset):
         assert os.path.exists(
             os.path.join(arrow_path, split + ".arrow")
         ), "The arrow directory {} of {} split does not exist!".format(arrow_path, split)
-        arrow_split_path = os.path.join(arrow_path, split + ".arrow")
-        self.df = pa.ipc.open_file(arrow_split_path).read_pandas()
-        # Fetch number of pairs and images
-        self.number_samples = len(self.df)
+        self.arrow_split_path = os.path.join(arrow_path, split + ".arrow")
+        # Fetch number of pairs and images, the table itself is opened lazily in each dataloader worker
+        self.number_samples = _open_arrow_table(self.arrow_split_path).num_rows
+        self.table = None
         self.number_images = self.number_samples
         logging.info(
             "{} Arrow file contains {} images and {} pairs.".format(split, self.number_images, self.number_samples)
@@ -78,8 +125,10 @@ class ArrowDataset(Dataset):
         self.max_txt_length = max_txt_length
 
         self.use_augment = use_augment
+        self.resolution = resolution
         self.transform = self._build_transform(resolution)
         self.tokenizer = tokenizer
+        self.sep_id = self.tokenizer.vocab["[SEP]"]
 
     def _build_transform(self, resolution):
         if self.split == "train" and self.use_augment:
@@ -88,40 +137,42 @@ class ArrowDataset(Dataset):
                     RandomResizedCrop(resolution, scale=(0.9, 1.0), interpolation="bicubic"),
                     RandomHorizontalFlip(0.5),
                     _convert_to_rgb,
-                    ToTensor(),
-                    Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+                    _ToNormalizedArray(IMAGE_MEAN, IMAGE_STD),
                 ]
             )
         else:
             transform = Compose(
                 [
-                    Resize((resolution, resolution), interpolation="bicubic"),
+                    _ResizeIfNeeded((resolution, resolution), interpolation="bicubic"),
                     _convert_to_rgb,
-                    ToTensor(),
-                    Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+                    _ToNormalizedArray(IMAGE_MEAN, IMAGE_STD),
                 ]
             )
         return transform
 
+    def _init_table(self):
+        self.table = _open_arrow_table(self.arrow_split_path)
+        # Resolve the columns once so that __getitem__ only indexes into them
+        self.captions = self.table.column("caption")
+        self.images = self.table.column("image")
+
     def __len__(self):
         return self.dataset_len
 
     def __getitem__(self, index):
+        if self.table is None:
+            self._init_table()
         sample_index = index % self.number_samples
-        data_raw = self.df.iloc[sample_index, :]
-        txt_raw = data_raw["caption"]
-        image_raw = data_raw["image"]
-        image_bytes = BytesIO(image_raw)
-        image_bytes.seek(0)
-        image = Image.open(image_bytes)
+        txt_raw = self.captions[sample_index].as_py()
+        image_raw = self.images[sample_index].as_py()
+        image = _open_image(image_raw, self.resolution)
         image = self.transform(image)
         texts = self.tokenizer(
-            [_preprocess_text(txt_raw)], max_length=self.max_txt_length, truncation=True, padding="max_length"
+            [_preprocess_text(txt_raw)], max_length=self.max_txt_length, truncation=True, padding=False
         )
         text = texts["input_ids"][0]
 
-        eos_index = text.index(self.tokenizer.vocab["[SEP]"])
-        eos_index = np.array(eos_index)
+        eos_index = np.argmax(np.asarray(text, dtype=np.int64) == self.sep_id)
         return {"pixel_values": image, "input_ids": text, "index": eos_index}
 
 
@@ -194,15 +245,20 @@ class EvalTxtDataset(Dataset):
 
         self.max_txt_length = max_txt_length
         self.tokenizer = tokenizer
+        # Tokenize all texts once with a single batched call, __getitem__ only indexes the cache.
+        # Samples are left unpadded, the collator pads each batch to its longest sequence.
+        self.input_ids = self.tokenizer(
+            [_preprocess_text(str(text)) for _, text in self.texts],
+            max_length=self.max_txt_length,
+            truncation=True,
+            padding=False,
+        )["input_ids"]
 
     def __len__(self):
         return len(self.texts)
 
     def __getitem__(self, idx):
-        text_id, text = self.texts[idx]
-        texts = self.tokenizer([_preprocess_text(str(text))], max_len=self.max_txt_length, padding="max_length")
-        text = texts["input_ids"][0]
-        return {"text_id": text_id, "input_ids": text}
+        return {"text_id": self.texts[idx][0], "input_ids": self.input_ids[idx]}
 
 
 class EvalImgDataset(Dataset):
@@ -212,30 +268,38 @@ class EvalImgDataset(Dataset):
         )
 
         logging.debug(f"Loading image arrow from {arrow_imgs_filename}.")
-        self.img_df = pa.ipc.open_file(arrow_imgs_filename).read_pandas()
-        self.number_images = len(self.img_df)
+        self.arrow_imgs_filename = arrow_imgs_filename
+        # The table itself is opened lazily in each dataloader worker
+        self.number_images = _open_arrow_table(arrow_imgs_filename).num_rows
+        self.table = None
+        self.resolution = resolution
         self.transform = self._build_transform(resolution)
         logging.info("The specified arrow directory contains {} images.".format(self.number_images))
 
     def _build_transform(self, resolution):
-        normalize = Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
         return Compose(
             [
-                Resize((resolution, resolution), interpolation="bicubic"),
+                _ResizeIfNeeded((resolution, resolution), interpolation="bicubic"),
                 _convert_to_rgb,
-                ToTensor(),
-                normalize,
+                _ToNormalizedArray(IMAGE_MEAN, IMAGE_STD),
             ]
         )
 
+    def _init_table(self):
+        self.table = _open_arrow_table(self.arrow_imgs_filename)
+        # Resolve the image column once and materialize the small image_id column up front
+        self.images = self.table.column("image")
+        self.image_ids = self.table.column("image_id").to_pylist()
+
     def __len__(self):
         return self.number_images
 
     def __getitem__(self, idx):
-        img_raw, img_id = self.img_df.iloc[idx]["image"], self.img_df.iloc[idx]["image_id"]
-        image_bytes = BytesIO(img_raw)
-        image_bytes.seek(0)
-        image = Image.open(image_bytes)
+        if self.table is None:
+            self._init_table()
+        img_raw = self.images[idx].as_py()
+        img_id = self.image_ids[idx]
+        image = _open_image(img_raw, self.resolution)
         image = self.transform(image)
         if img_id.isnumeric():
             img_id = int(img_id)
@@ -14,12 +14,14 @@
 
 import distutils.util
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import fastdeploy as fd
 import numpy as np
 from PIL import Image
 
-from paddlenlp.transformers import ErnieViLProcessor
+from paddlenlp.transformers import AutoTokenizer, ErnieViLProcessor
+from paddlenlp.utils.log import logger
 
 
 def parse_arguments():
@@ -46,6 +48,12 @@ def parse_arguments():
     parser.add_argument("--max_length", type=int, default=128, help="The max length of sequence.")
     parser.add_argument("--log_interval", type=int, default=10, help="The interval of logging.")
     parser.add_argument("--use_fp16", type=distutils.util.strtobool, default=False, help="Wheter to use FP16 mode")
+    parser.add_argument(
+        "--print_probs",
+        type=distutils.util.strtobool,
+        default=True,
+        help="Whether to compute and print the label probabilities.",
+    )
     parser.add_argument(
         "--use_fast",
         type=distutils.util.strtobool,
@@ -74,6 +82,12 @@ def parse_arguments():
 class ErnieVil2Predictor(object):
     def __init__(self, args):
         self.processor = ErnieViLProcessor.from_pretrained("PaddlePaddle/ernie_vil-2.0-base-zh")
+        if args.use_fast:
+            self.processor.tokenizer = AutoTokenizer.from_pretrained(
+                "PaddlePaddle/ernie_vil-2.0-base-zh", use_fast=True
+            )
+            if not self.processor.tokenizer.is_fast:
+                logger.warning("Fast tokenizer is not available, falling back to the python tokenizer.")
         self.runtime = self.create_fd_runtime(args)
         self.batch_size = args.batch_size
         self.max_length = args.max_length
@@ -129,10 +143,14 @@ class ErnieVil2Predictor(object):
         return fd.Runtime(option)
 
     def preprocess(self, inputs):
+        # Encode the whole batch with a single processor call instead of one call per example
         if self.encode_type == "text":
-            dataset = [np.array([self.processor(text=text)["input_ids"] for text in inputs], dtype="int64")]
+            encoded_inputs = self.processor(
+                text=inputs, max_length=self.max_length, padding=True, truncation=True, return_tensors="np"
+            )
+            dataset = [encoded_inputs["input_ids"].astype("int64")]
         else:
-            dataset = [np.array([self.processor(images=image)["pixel_values"][0] for image in inputs])]
+            dataset = [self.processor(images=inputs, return_tensors="np")["pixel_values"]]
         input_map = {}
         for input_field_id, data in enumerate(dataset):
             input_field = self.runtime.get_input_info(input_field_id).name
@@ -151,9 +169,22 @@ class ErnieVil2Predictor(object):
         return results
 
     def predict(self, inputs):
-        input_map = self.preprocess(inputs)
-        infer_result = self.infer(input_map)
-        output = self.postprocess(infer_result)
+        batches = [inputs[idx : idx + self.batch_size] for idx in range(0, len(inputs), self.batch_size)]
+        if len(batches) == 0:
+            return {"features": np.empty((0,), dtype="float32")}
+        features = []
+        # Preprocess the next batch in a background thread while the runtime infers the current one
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_input_map = executor.submit(self.preprocess, batches[0])
+            for batch_idx in range(len(batches)):
+                input_map = next_input_map.result()
+                if batch_idx + 1 < len(batches):
+                    next_input_map = executor.submit(self.preprocess, batches[batch_idx + 1])
+                infer_result = self.infer(input_map)
+                features.append(self.postprocess(infer_result)["features"])
+        output = {
+            "features": np.concatenate(features, axis=0),
+        }
         return output
 
 
@@ -176,14 +207,18 @@ def main():
     outputs = predictor.predict(images)
     image_feats = outputs["features"]
     print(image_feats)
-    from scipy.special import softmax
 
     image_feats = image_feats / np.linalg.norm(image_feats, ord=2, axis=-1, keepdims=True)
     text_feats = text_feats / np.linalg.norm(text_feats, ord=2, axis=-1, keepdims=True)
     # Get from dygraph， refer to predict.py
     exp_data = np.exp(args.temperature)
-    m = softmax(np.matmul(exp_data * text_feats, image_feats.T), axis=0).T
-    print(m)
+    logits = np.matmul(exp_data * image_feats, text_feats.T)
+    # Softmax is order-preserving, so the label is taken from the raw logits directly
+    print("Predicted labels:", [texts[idx] for idx in np.argmax(logits, axis=-1)])
+    if args.print_probs:
+        from scipy.special import softmax
+
+        print(softmax(logits, axis=-1))
 
 
 if __name__ == "__main__":
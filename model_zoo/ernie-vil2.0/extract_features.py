@@ -21,7 +21,8 @@ from paddle.io import DataLoader
 from tqdm import tqdm
 
 from paddlenlp.data import DataCollatorWithPadding
-from paddlenlp.transformers import ErnieViLModel, ErnieViLTokenizer
+from paddlenlp.transformers import AutoTokenizer, ErnieViLModel
+from paddlenlp.utils.log import logger
 
 # yapf: disable
 parser = argparse.ArgumentParser()
@@ -33,6 +34,8 @@ parser.add_argument('--image-feat-output-path', type=str, default=None, help="If
 parser.add_argument('--text-feat-output-path', type=str, default=None, help="If --extract-image-feats is True, specify the path of output text features.")
 parser.add_argument("--img-batch-size", type=int, default=64, help="Image batch size.")
 parser.add_argument("--text-batch-size", type=int, default=64, help="Text batch size.")
+parser.add_argument("--num-workers", type=int, default=4, help="Number of subprocesses used to load the eval data.")
+parser.add_argument("--amp-dtype", type=str, default=None, choices=["float16", "bfloat16"], help="If set, run the encoders with O2 mixed precision in the given dtype.")
 parser.add_argument("--context-length", type=int, default=64, help="The maximum length of input text (include [CLS] & [SEP] tokens).")
 parser.add_argument("--resume", default=None, type=str, help="path to latest checkpoint (default: none)",)
 args = parser.parse_args()
@@ -47,23 +50,44 @@ def main():
     else:
         # Zero shot
         model = ErnieViLModel.from_pretrained("PaddlePaddle/ernie_vil-2.0-base-zh")
+    model.eval()
+    use_amp = args.amp_dtype is not None
+    amp_dtype = args.amp_dtype if use_amp else "float16"
+    if use_amp:
+        model = paddle.amp.decorate(models=model, level="O2", dtype=amp_dtype)
 
     # Make inference for texts
     if args.extract_text_feats:
-        tokenizer = ErnieViLTokenizer.from_pretrained("ernie_vil-2.0-base-zh")
+        tokenizer = AutoTokenizer.from_pretrained("ernie_vil-2.0-base-zh", use_fast=True)
+        if not tokenizer.is_fast:
+            logger.warning("Fast tokenizer is not available, falling back to the python tokenizer.")
         eval_dataset = get_eval_txt_dataset(args, tokenizer=tokenizer, max_txt_length=args.context_length)
         my_collate = DataCollatorWithPadding(tokenizer)
-        text_loader = DataLoader(eval_dataset, collate_fn=my_collate, batch_size=args.text_batch_size)
+        text_loader = DataLoader(
+            eval_dataset,
+            collate_fn=my_collate,
+            batch_size=args.text_batch_size,
+            num_workers=args.num_workers,
+            use_shared_memory=True,
+            prefetch_factor=4,
+            persistent_workers=args.num_workers > 0,
+        )
         print("Make inference for texts...")
         if args.text_feat_output_path is None:
             args.text_feat_output_path = "{}.txt_feat.jsonl".format(args.text_data[:-6])
+        # Convert the text encoder to static graph, it is traced once on the first batch
+        get_text_features = paddle.jit.to_static(
+            model.get_text_features,
+            input_spec=[
+                paddle.static.InputSpec(shape=[None, None], dtype="int64"),  # input_ids
+            ],
+        )
         write_cnt = 0
         with open(args.text_feat_output_path, "w") as fout:
-            model.eval()
-            with paddle.no_grad():
+            with paddle.no_grad(), paddle.amp.auto_cast(enable=use_amp, level="O2", dtype=amp_dtype):
                 for batch in tqdm(text_loader):
                     text_ids, texts = batch["text_id"], batch["input_ids"]
-                    text_features = model.get_text_features(texts)
+                    text_features = get_text_features(texts).astype("float32")
                     text_features /= text_features.norm(axis=-1, keepdim=True)
                     for text_id, text_feature in zip(text_ids.tolist(), text_features.tolist()):
                         fout.write("{}\n".format(json.dumps({"text_id": text_id, "feature": text_feature})))
@@ -73,18 +97,32 @@ def main():
     # Make inference for images
     if args.extract_image_feats:
         image_eval_dataset = get_eval_img_dataset(args)
-        image_loader = DataLoader(image_eval_dataset, batch_size=args.img_batch_size)
+        image_loader = DataLoader(
+            image_eval_dataset,
+            batch_size=args.img_batch_size,
+            num_workers=args.num_workers,
+            use_shared_memory=True,
+            prefetch_factor=4,
+            persistent_workers=args.num_workers > 0,
+        )
         print("Make inference for images...")
         if args.image_feat_output_path is None:
             # by default, we store the image features under the same directory with the text features
             args.image_feat_output_path = "{}.img_feat.jsonl".format(args.text_data.replace("_texts.jsonl", "_imgs"))
+        # Convert the image encoder to static graph, it is traced once on the first batch
+        image_size = model.config.vision_config.image_size
+        get_image_features = paddle.jit.to_static(
+            model.get_image_features,
+            input_spec=[
+                paddle.static.InputSpec(shape=[None, 3, image_size, image_size], dtype="float32"),  # pixel_values
+            ],
+        )
         write_cnt = 0
         with open(args.image_feat_output_path, "w") as fout:
-            model.eval()
-            with paddle.no_grad():
+            with paddle.no_grad(), paddle.amp.auto_cast(enable=use_amp, level="O2", dtype=amp_dtype):
                 for batch in tqdm(image_loader):
                     image_ids, images = batch
-                    image_features = model.get_image_features(pixel_values=images)
+                    image_features = get_image_features(images).astype("float32")
                     image_features /= image_features.norm(axis=-1, keepdim=True)
                     if type(image_ids) != list:
                         image_ids = image_ids.tolist()
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
+import distutils.util
 
 import paddle
 import paddle.nn.functional as F
@@ -23,6 +24,7 @@ from paddlenlp.transformers import ErnieViLModel, ErnieViLProcessor, ErnieViLTok
 parser = argparse.ArgumentParser()
 parser.add_argument("--resume", default=None, type=str, help="path to latest checkpoint (default: none)",)
 parser.add_argument("--image_path", default="000000039769.jpg", type=str, help="image_path used for prediction",)
+parser.add_argument("--print_probs", default=True, type=distutils.util.strtobool, help="Whether to compute and print the label probabilities.",)
 args = parser.parse_args()
 # yapf: enable
 
@@ -57,10 +59,13 @@ def main():
         image_features /= image_features.norm(axis=-1, keepdim=True)
         text_features /= text_features.norm(axis=-1, keepdim=True)
         ret = model(pixel_values=images["pixel_values"], input_ids=texts["input_ids"])
-        logits_per_image = (ret.logits_per_image,)
-        probs = F.softmax(logits_per_image, axis=-1)
+        logits_per_image = ret.logits_per_image
+        # Softmax is order-preserving, so the label is taken from the raw logits directly
+        label_ids = paddle.argmax(logits_per_image, axis=-1).numpy().tolist()
+        if args.print_probs:
+            print("Label probs:", F.softmax(logits_per_image, axis=-1))
 
-    print("Label probs:", probs)
+    print("Predicted labels:", [source_text[idx] for idx in label_ids])
 
 
 if __name__ == "__main__":
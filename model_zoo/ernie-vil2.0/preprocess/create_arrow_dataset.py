@@ -36,9 +36,8 @@ from tqdm import tqdm
 
 def id2rest(photo_id, iid2photo, iid2captions):
     captions = iid2captions[photo_id]
-    photo_data = iid2photo[photo_id]
-    photo_data = photo_data.encode("utf-8")
-    photo_data = base64.urlsafe_b64decode(photo_data)
+    # urlsafe_b64decode accepts the ASCII str directly, no need to re-encode it to bytes first
+    photo_data = base64.urlsafe_b64decode(iid2photo[photo_id])
     return [photo_data, captions, photo_id]
 
 
@@ -22,7 +22,8 @@ from trainer_util import ErnieViLTrainer
 
 from paddlenlp.data import DataCollatorWithPadding
 from paddlenlp.trainer import PdArgumentParser, TrainingArguments
-from paddlenlp.transformers import ErnieViLModel, ErnieViLTokenizer
+from paddlenlp.transformers import AutoTokenizer, ErnieViLModel
+from paddlenlp.utils.log import logger
 
 os.environ["NCCL_DEBUG"] = "INFO"
 
@@ -67,7 +68,9 @@ def do_train():
     if paddle.distributed.is_initialized() and paddle.distributed.get_world_size() > 1:
         paddle.distributed.init_parallel_env()
 
-    tokenizer = ErnieViLTokenizer.from_pretrained(model_args.model_name_or_path)
+    tokenizer = AutoTokenizer.from_pretrained(model_args.model_name_or_path, use_fast=True)
+    if not tokenizer.is_fast:
+        logger.warning("Fast tokenizer is not available, falling back to the python tokenizer.")
     train_dataset, eval_dataset = get_train_eval_dataset(
         data_args, tokenizer=tokenizer, max_txt_length=data_args.max_seq_len
     )
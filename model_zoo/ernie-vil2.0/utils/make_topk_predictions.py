@@ -52,6 +52,11 @@ if __name__ == "__main__":
             image_ids.append(obj["image_id"])
             image_feats.append(obj["feature"])
     image_feats_array = np.array(image_feats, dtype=np.float32)
+    # Copy the image features to device once instead of once per text line
+    image_feats_tensors = [
+        paddle.to_tensor(image_feats_array[idx : idx + args.eval_batch_size]).cuda()
+        for idx in range(0, len(image_ids), args.eval_batch_size)
+    ]  # [batch_size, feature_dim] each
     print("Finished loading image features.")
 
     print("Begin to compute top-{} predictions for texts...".format(args.top_k))
@@ -64,18 +69,14 @@ if __name__ == "__main__":
                 text_feat = obj["feature"]
                 score_tuples = []
                 text_feat_tensor = paddle.to_tensor([text_feat], dtype="float32")  # [1, feature_dim]
-                idx = 0
-                while idx < len(image_ids):
-                    img_feats_tensor = paddle.to_tensor(
-                        image_feats_array[idx : min(idx + args.eval_batch_size, len(image_ids))]
-                    ).cuda()  # [batch_size, feature_dim]
+                for batch_idx, img_feats_tensor in enumerate(image_feats_tensors):
+                    idx = batch_idx * args.eval_batch_size
                     batch_scores = text_feat_tensor @ img_feats_tensor.t()  # [1, batch_size]
                     for image_id, score in zip(
                         image_ids[idx : min(idx + args.eval_batch_size, len(image_ids))],
                         batch_scores.squeeze(0).tolist(),
                     ):
                         score_tuples.append((image_id, score))
-                    idx += args.eval_batch_size
                 top_k_predictions = sorted(score_tuples, key=lambda x: x[1], reverse=True)[: args.top_k]
                 fout.write(
                     "{}\n".format(
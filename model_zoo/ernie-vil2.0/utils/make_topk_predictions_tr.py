@@ -52,6 +52,11 @@ if __name__ == "__main__":
             text_ids.append(obj["text_id"])
             text_feats.append(obj["feature"])
     text_feats_array = np.array(text_feats, dtype=np.float32)
+    # Copy the text features to device once instead of once per image line
+    text_feats_tensors = [
+        paddle.to_tensor(text_feats_array[idx : idx + args.eval_batch_size]).cuda()
+        for idx in range(0, len(text_ids), args.eval_batch_size)
+    ]  # [batch_size, feature_dim] each
     print("Finished loading text features.")
 
     print("Begin to compute top-{} predictions for images...".format(args.top_k))
@@ -63,18 +68,14 @@ if __name__ == "__main__":
                 image_feat = obj["feature"]
                 score_tuples = []
                 image_feat_tensor = paddle.to_tensor([image_feat], dtype="float32")  # [1, feature_dim]
-                idx = 0
-                while idx < len(text_ids):
-                    text_feats_tensor = paddle.to_tensor(
-                        text_feats_array[idx : min(idx + args.eval_batch_size, len(text_ids))]
-                    ).cuda()  # [batch_size, feature_dim]
+                for batch_idx, text_feats_tensor in enumerate(text_feats_tensors):
+                    idx = batch_idx * args.eval_batch_size
                     batch_scores = image_feat_tensor @ text_feats_tensor.t()  # [1, batch_size]
                     for text_id, score in zip(
                         text_ids[idx : min(idx + args.eval_batch_size, len(text_ids))],
                         batch_scores.squeeze(0).tolist(),
                     ):
                         score_tuples.append((text_id, score))
-                    idx += args.eval_batch_size
                 top_k_predictions = sorted(score_tuples, key=lambda x: x[1], reverse=True)[: args.top_k]
                 fout.write(
                     "{}\n".format(
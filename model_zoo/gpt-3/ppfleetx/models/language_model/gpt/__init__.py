@@ -17,6 +17,7 @@ from .auto.auto_model import (
     GPTForPretrainingAuto,
     GPTModelAuto,
     GPTPretrainingCriterionAuto,
+    convert_to_fused_ffn_state_dict,
 )
 from .dygraph.hybrid_model import (
     GPTForGenerationHybrid,
@@ -32,6 +32,7 @@ from ppfleetx.utils.log import logger
 from ..dygraph.processor import (
     ForcedBOSTokenLogitsProcessor,
     ForcedEOSTokenLogitsProcessor,
+    FusedLogitsProcessor,
     HammingDiversityLogitsProcessor,
     LogitsProcessorList,
     MinLengthLogitsProcessor,
@@ -42,18 +43,38 @@ try:
     from paddle.incubate.nn.layer.fused_dropout_add import FusedDropoutAdd
 except:
     FusedDropoutAdd = None
-FusedDropoutAdd = None
+
+try:
+    from paddle.incubate.nn import FusedFeedForward
+except:
+    FusedFeedForward = None
+
+try:
+    from paddle.incubate.nn.functional import fused_bias_dropout_residual_layer_norm
+except:
+    fused_bias_dropout_residual_layer_norm = None
 
 try:
     from paddle.nn.functional.flash_attention import flash_attention
 except:
     flash_attention = None
 
+try:
+    from paddle.nn.functional.flash_attention import scaled_dot_product_attention
+except:
+    scaled_dot_product_attention = None
+
 try:
     from paddle.jit.api import set_dynamic_shape
 except:
     from paddle.jit.dy2static.utils_helper import set_dynamic_shape
 
+
+# Whether scaled_dot_product_attention accepts a user mask. Older Paddle releases reject one, this is cleared
+# the first time a masked call fails and masked attention then always runs core_attn.
+sdpa_supports_attn_mask = scaled_dot_product_attention is not None
+
+
 def shard_op_for_sequence_parallel_linear(tgt, mesh):
     # FIXME Hack to shard op for module (linear)
     # we only shard the second to the last op (matmul) leave the last op (elementwise_add) un-touched
@@ -79,11 +100,37 @@ def shard_op_for_sequence_parallel_linear(tgt, mesh):
     tensor_dist_attr.mark_annotated("dims_mapping")
 
 
+def convert_to_fused_ffn_state_dict(state_dict, normalize_before=True):
+    """
+    Rename the feed-forward parameters of a structured state dict saved without `use_fused_ffn`
+    (`*.linear1.weight`, `*.linear2.bias`, `*.norm2.weight`, ...) to the FusedFeedForward ones
+    (`*.ffn._linear1_weight`, ...), so the checkpoint can be loaded into a model using the fused ffn.
+    """
+    ln_prefix = "_ln1" if normalize_before else "_ln2"
+    suffix_map = {
+        ".linear1.weight": ".ffn._linear1_weight",
+        ".linear1.bias": ".ffn._linear1_bias",
+        ".linear2.weight": ".ffn._linear2_weight",
+        ".linear2.bias": ".ffn._linear2_bias",
+        ".norm2.weight": ".ffn.{}_scale".format(ln_prefix),
+        ".norm2.bias": ".ffn.{}_bias".format(ln_prefix),
+    }
+    converted = collections.OrderedDict()
+    for key, value in state_dict.items():
+        for old_suffix, new_suffix in suffix_map.items():
+            if key.endswith(old_suffix) and ".decoder.layers." in key:
+                key = key[: -len(old_suffix)] + new_suffix
+                break
+        converted[key] = value
+    return converted
+
+
 def get_attr(layer, name):
-    if getattr(layer, name, None) is not None:
-        return getattr(layer, name, None)
-    else:
-        return get_attr(layer._layer, name)
+    value = getattr(layer, name, None)
+    if value is not None:
+        return value
+    # wrapped layers (e.g. by quantization) keep the original one in `_layer`
+    return get_attr(layer._layer, name)
 
 
 class MultiHeadAttention(nn.Layer):
@@ -115,6 +162,7 @@ class MultiHeadAttention(nn.Layer):
         use_flash_attn=False,
         ipp=None,
         sequence_parallel=False,
+        compute_dtype=None,
     ):
         super(MultiHeadAttention, self).__init__()
         self.embed_dim = embed_dim
@@ -130,15 +178,17 @@ class MultiHeadAttention(nn.Layer):
         self.ipp = ipp
         self.use_flash_attn = use_flash_attn if flash_attention else None
         self.sequence_parallel = sequence_parallel
+        self.compute_dtype = compute_dtype
 
 
         self.head_dim = embed_dim // num_heads
         assert self.head_dim * num_heads == self.embed_dim, "embed_dim[{}] must be divisible by num_heads[{}]".format(self.embed_dim, num_heads)
 
         if self.fuse_attn_qkv:
-            assert self.kdim == embed_dim
-            assert self.vdim == embed_dim
-            self.qkv_proj = nn.Linear(embed_dim, 3 * embed_dim, weight_attr, bias_attr=bias_attr)
+            # q, k and v share one projection so that self-attention costs a single GEMM. Inputs narrower than
+            # the fused weight (kdim or vdim != embed_dim) are zero-padded, the extra rows only ever see zeros.
+            self.qkv_in_dim = max(embed_dim, self.kdim, self.vdim)
+            self.qkv_proj = nn.Linear(self.qkv_in_dim, 3 * embed_dim, weight_attr, bias_attr=bias_attr)
         else:
             self.q_proj = nn.Linear(embed_dim, embed_dim, weight_attr, bias_attr=bias_attr)
             self.k_proj = nn.Linear(self.kdim, embed_dim, weight_attr, bias_attr=bias_attr)
@@ -146,52 +196,91 @@ class MultiHeadAttention(nn.Layer):
 
         self.out_proj = nn.Linear(embed_dim, embed_dim, output_layer_weight_attr, bias_attr=bias_attr)
 
-    def _fuse_prepare_qkv(self, query, use_cache=False, cache=None):
+    def _pad_to_qkv_in_dim(self, x):
+        pad = self.qkv_in_dim - x.shape[-1]
+        if pad == 0:
+            return x
+        return paddle.concat([x, paddle.tile(paddle.zeros_like(x[:, :, :1]), [1, 1, pad])], axis=-1)
+
+    def _split_heads(self, x, head_major=False):
+        x = tensor.reshape(x=x, shape=[0, 0, -1, self.head_dim])
+        if head_major:
+            x = tensor.transpose(x=x, perm=[1, 2, 0, 3] if self.sequence_parallel else [0, 2, 1, 3])
+        elif self.sequence_parallel:
+            # flash-attention takes [b, s, nhead, ndim]
+            x = tensor.transpose(x=x, perm=[1, 0, 2, 3])
+        return x
+
+    def _fuse_project(self, x, index, head_major=False):
+        # Cross-attention with the fused weight: project the whole qkv and keep q(0), k(1) or v(2). This costs
+        # more flops than a third of the weight but never copies a strided slice of it.
+        mix_layer = self.qkv_proj(self._pad_to_qkv_in_dim(x))
+        mix_layer = paddle.reshape_(mix_layer, [0, 0, -1, 3, self.head_dim])
+        out = paddle.reshape(mix_layer[:, :, :, index, :], [0, 0, self.embed_dim])
+        return self._split_heads(out, head_major)
+
+    def _fuse_prepare_qkv(self, query, use_cache=False, cache=None, head_major=False):
         auto.shard_tensor(self.qkv_proj.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
 
-        mix_layer = self.qkv_proj(query)
-        mix_layer = paddle.reshape_(mix_layer, [0, 0, -1, 3 * self.head_dim])
-        q, k, v = paddle.split(mix_layer, num_or_sections=3, axis=-1)
+        mix_layer = self.qkv_proj(self._pad_to_qkv_in_dim(query))
+        if head_major:
+            # [b, s, nhead, 3, ndim] ([s, b, nhead, 3, ndim] if sequence_parallel) -> [3, b, nhead, s, ndim],
+            # one transpose for q, k and v together instead of one per tensor in core_attn
+            mix_layer = paddle.reshape_(mix_layer, [0, 0, -1, 3, self.head_dim])
+            perm = [3, 1, 2, 0, 4] if self.sequence_parallel else [3, 0, 2, 1, 4]
+            q, k, v = paddle.unbind(tensor.transpose(x=mix_layer, perm=perm), axis=0)
+        else:
+            if self.sequence_parallel:
+                # flash-attention takes [b, s, nhead, ndim], transpose the fused [s, b, 3 * hidden] once
+                # instead of q, k and v one by one
+                mix_layer = tensor.transpose(x=mix_layer, perm=[1, 0, 2])
+            mix_layer = paddle.reshape_(mix_layer, [0, 0, -1, 3 * self.head_dim])
+            q, k, v = paddle.split(mix_layer, num_or_sections=3, axis=-1)
 
         assert not isinstance(cache, self.StaticCache), "cache currently does not support the StaticCache type"
 
         if isinstance(cache, self.Cache):
             # for decoder self-attention in inference
-            k = tensor.concat([cache.k, k], axis=1)
-            v = tensor.concat([cache.v, v], axis=1)
+            k = tensor.concat([cache.k, k], axis=2 if head_major else 1)
+            v = tensor.concat([cache.v, v], axis=2 if head_major else 1)
         if use_cache is True:
             cache = self.Cache(k, v)
 
         return (q, k, v, cache) if use_cache else (q, k, v, None)
 
-    def _prepare_qkv(self, query, key, value, use_cache=False, cache=None):
+    def _prepare_qkv(self, query, key, value, use_cache=False, cache=None, head_major=False):
         r"""
         Prapares linear projected queries, keys and values for usage of subsequnt
         multiple parallel attention. If `cache` is not None, using cached results
         to reduce redundant calculations.
 
         """
-        auto.shard_tensor(self.q_proj.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
-
-        q = self.q_proj(query)
-        q = tensor.reshape(x=q, shape=[0, 0, -1, self.head_dim])
+        if self.fuse_attn_qkv:
+            if key is query and value is query and not isinstance(cache, self.StaticCache):
+                # self-attention, project q, k and v with one matmul
+                return self._fuse_prepare_qkv(query, use_cache, cache, head_major)
+            auto.shard_tensor(self.qkv_proj.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
+            q = self._fuse_project(query, 0, head_major)
+        else:
+            auto.shard_tensor(self.q_proj.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
+            q = self._split_heads(self.q_proj(query), head_major)
 
         if isinstance(cache, self.StaticCache):
             # for encoder-decoder attention in inference and has cached
             k, v = cache.k, cache.v
         else:
-            k, v = self.compute_kv(key, value)
+            k, v = self.compute_kv(key, value, head_major)
 
         if isinstance(cache, self.Cache):
             # for decoder self-attention in inference
-            k = tensor.concat([cache.k, k], axis=1)
-            v = tensor.concat([cache.v, v], axis=1)
+            k = tensor.concat([cache.k, k], axis=2 if head_major else 1)
+            v = tensor.concat([cache.v, v], axis=2 if head_major else 1)
         if use_cache is True:
             cache = self.Cache(k, v)
 
         return (q, k, v, cache) if use_cache else (q, k, v, None)
 
-    def compute_kv(self, key, value):
+    def compute_kv(self, key, value, head_major=True):
         r"""
         Applies linear projection on input keys and values, then splits heads
         (reshape and transpose) to get keys and values from different representation
@@ -203,13 +292,14 @@ class MultiHeadAttention(nn.Layer):
         to construct cache for inference.
 
         """
+        if self.fuse_attn_qkv:
+            return self._fuse_project(key, 1, head_major), self._fuse_project(value, 2, head_major)
+
         auto.shard_tensor(self.k_proj.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
         auto.shard_tensor(self.v_proj.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
 
-        k = self.k_proj(key)
-        v = self.v_proj(value)
-        k = tensor.reshape(x=k, shape=[0, 0, -1, self.head_dim])
-        v = tensor.reshape(x=v, shape=[0, 0, -1, self.head_dim])
+        k = self._split_heads(self.k_proj(key), head_major)
+        v = self._split_heads(self.v_proj(value), head_major)
         return k, v
 
     def gen_cache(self, key, value=None, type=Cache):
@@ -234,18 +324,35 @@ class MultiHeadAttention(nn.Layer):
             return self.Cache(key, value)
 
     def _flash_attention(self, q, k, v, attn_mask=None):
+        global sdpa_supports_attn_mask
 
-        # if sequence_parallel, the activation is [s, b, h], but flash attention lib need [b, s, h]
-        # we revert it to be [b, s, h] before 
-        if self.sequence_parallel:
-            perm = [1, 0, 2, 3]
-            q = tensor.transpose(x=q, perm=perm)
-            k = tensor.transpose(x=k, perm=perm)
-            v = tensor.transpose(x=v, perm=perm)
+        # input shape is [b, s, nhead, ndim] not matter sequence_parallel or not,
+        # if sequence_parallel, _prepare_qkv has already moved the [s, b, h] activation to [b, s]
 
-        out, weights = flash_attention(
-            q, k, v, self.dropout, causal=True, return_softmax=self.need_weights, training=self.training
-        )
+        if attn_mask is None:
+            out, weights = flash_attention(
+                q, k, v, self.dropout, causal=True, return_softmax=self.need_weights, training=self.training
+            )
+        else:
+            # the additive mask already carries the causal part, use the tiled memory-efficient kernel with it
+            try:
+                out = scaled_dot_product_attention(
+                    q,
+                    k,
+                    v,
+                    attn_mask=paddle.cast(attn_mask, q.dtype),
+                    dropout_p=self.dropout,
+                    is_causal=False,
+                    training=self.training,
+                )
+            except (AssertionError, NotImplementedError, TypeError, ValueError) as e:
+                sdpa_supports_attn_mask = False
+                logger.warning("scaled_dot_product_attention does not support attn_mask, use core_attn: {}".format(e))
+                perm = [0, 2, 1, 3]
+                return self.core_attn(
+                    tensor.transpose(q, perm), tensor.transpose(k, perm), tensor.transpose(v, perm), attn_mask
+                )
+            weights = None
         out = tensor.reshape(x=out, shape=[0, 0, out.shape[2] * out.shape[3]])
 
         # and convert it back to [s, b, h] after
@@ -256,19 +363,22 @@ class MultiHeadAttention(nn.Layer):
         return (out, weights)
 
     def core_attn(self, q, k, v, attn_mask=None):
-        # input shape is [b, s, nhead, ndim] or [s, b, nhead, ndim] if sequence_parallel
-        # after transpose, [b, nhead, s, ndim] not matter sequence_parallel or not 
-        perm = [1, 2, 0, 3] if self.sequence_parallel else [0, 2, 1, 3]
-        q = tensor.transpose(x=q, perm=perm)
-        k = tensor.transpose(x=k, perm=perm)
-        v = tensor.transpose(x=v, perm=perm)
-
+        # input shape is [b, nhead, s, ndim] not matter sequence_parallel or not,
+        # the head-major layout is produced by _prepare_qkv
         # scale dot product attention
-        scale_qk_coeff = self.scale_qk_coeff * self.head_dim**0.5
-        product = paddle.matmul(x=q.scale(1.0 / scale_qk_coeff), y=k, transpose_y=True)
-
-        if self.scale_qk_coeff != 1.0:
+        # Dividing q by scale_qk_coeff only keeps an fp16 product from overflowing, the rescale then restores it.
+        # Other dtypes skip that extra pass over the scores. Auto-parallel AMP casts the static program after it
+        # is built, so the configured compute dtype decides; without one, only a dygraph fp32 q skips it.
+        if self.compute_dtype is not None:
+            scale_for_fp16 = self.compute_dtype == "float16"
+        else:
+            scale_for_fp16 = not paddle.in_dynamic_mode() or q.dtype == paddle.float16
+        if self.scale_qk_coeff != 1.0 and scale_for_fp16:
+            scale_qk_coeff = self.scale_qk_coeff * self.head_dim**0.5
+            product = paddle.matmul(x=q.scale(1.0 / scale_qk_coeff), y=k, transpose_y=True)
             product = product.scale(self.scale_qk_coeff)
+        else:
+            product = paddle.matmul(x=q.scale(1.0 / self.head_dim**0.5), y=k, transpose_y=True)
 
         if attn_mask is not None:
             product = product + attn_mask
@@ -300,16 +410,15 @@ class MultiHeadAttention(nn.Layer):
         """
         key = query if key is None else key
         value = query if value is None else value
-        # compute q ,k ,v
-        if self.fuse_attn_qkv:
-            q, k, v, cache = self._fuse_prepare_qkv(query, use_cache, cache)
-        else:
-            q, k, v, cache = self._prepare_qkv(query, key, value, use_cache, cache)
 
-        if self.use_flash_attn and attn_mask is None:
-            attn_func = self._flash_attention
-        else:
-            attn_func = self.core_attn
+        # flash attention is only used without cache: the cache always keeps the head-major layout of
+        # core_attn (see `gen_cache`) and the decoding step attends a single token. Without mask support
+        # in scaled_dot_product_attention, masked calls fall back to core_attn.
+        use_flash_attn = self.use_flash_attn and not use_cache and (attn_mask is None or sdpa_supports_attn_mask)
+        attn_func = self._flash_attention if use_flash_attn else self.core_attn
+
+        # compute q ,k ,v, flash-attention takes [b, s, nhead, ndim] and core_attn takes [b, nhead, s, ndim]
+        q, k, v, cache = self._prepare_qkv(query, key, value, use_cache, cache, head_major=not use_flash_attn)
 
         if self.use_recompute and self.recompute_granularity == "core_attn":
             out, weights = auto.recompute(attn_func)(q, k, v, attn_mask)
@@ -442,13 +551,12 @@ class TransformerDecoderLayer(nn.Layer):
         recompute_granularity="full",
         use_flash_attn=False,
         use_fused_dropout_add=True,
+        use_fused_ffn=False,
+        use_fused_dropout_residual_ln=False,
         ipp=None,
         sequence_parallel=False,
+        compute_dtype=None,
     ):
-        self._config = locals()
-        self._config.pop("self")
-        self._config.pop("__class__", None)  # py3
-
         super(TransformerDecoderLayer, self).__init__()
         attn_dropout = dropout if attn_dropout is None else attn_dropout
         act_dropout = dropout if act_dropout is None else act_dropout
@@ -463,6 +571,37 @@ class TransformerDecoderLayer(nn.Layer):
         else:
             self.use_fused_dropout_add = use_fused_dropout_add
 
+        # Post-norm computes layer_norm(residual + dropout(x)) with one fused op. Pre-norm needs the sum itself
+        # as the next residual, which the fused op does not return, so it keeps FusedDropoutAdd + LayerNorm.
+        # It is opt-in since the fused kernel does not reproduce the unfused numerics bit for bit.
+        self.use_fused_dropout_residual_ln = (
+            use_fused_dropout_residual_ln
+            and not normalize_before
+            and fused_bias_dropout_residual_layer_norm is not None
+            and not sequence_parallel
+        )
+        if use_fused_dropout_residual_ln and not self.use_fused_dropout_residual_ln:
+            logger.warning(
+                "fused_bias_dropout_residual_layer_norm is only used for post-norm layers without sequence_parallel "
+                "and with a Paddle version providing it."
+            )
+        self.dropout_rate = dropout
+        self.act_dropout_rate = act_dropout
+
+        # FusedFeedForward runs layer_norm, linear1 + activation + linear2, dropout and the residual add as one op.
+        # The SP region needs the standalone linear2 matmul for its annotation, so SP keeps the unfused ffn.
+        # The fused "gelu" is the exact one while the unfused layer uses the tanh approximation, so gelu layers
+        # also keep the unfused ffn rather than silently changing the model numerics.
+        # Checkpoints of the unfused ffn are loaded with `convert_to_fused_ffn_state_dict`.
+        self.use_fused_ffn = (
+            use_fused_ffn and FusedFeedForward is not None and not sequence_parallel and activation != "gelu"
+        )
+        if use_fused_ffn and not self.use_fused_ffn:
+            logger.warning(
+                "FusedFeedForward is not used: it is not available with this Paddle version, sequence_parallel "
+                "is enabled, or the activation is the approximate gelu the fused op does not implement."
+            )
+
         weight_attrs = _convert_param_attr_to_list(weight_attr, 3)
         bias_attrs = _convert_param_attr_to_list(bias_attr, 3)
         output_layer_weight_attrs = _convert_param_attr_to_list(output_layer_weight_attr, 3)
@@ -481,13 +620,29 @@ class TransformerDecoderLayer(nn.Layer):
             use_flash_attn=use_flash_attn,
             ipp=ipp,
             sequence_parallel=sequence_parallel,
+            compute_dtype=compute_dtype,
         )
 
-        self.linear1 = nn.Linear(d_model, dim_feedforward, weight_attrs[2], bias_attr=bias_attrs[2])
-        self.linear2 = nn.Linear(dim_feedforward, d_model, output_layer_weight_attrs[2], bias_attr=bias_attrs[2])
+        if self.use_fused_ffn:
+            self.ffn = FusedFeedForward(
+                d_model,
+                dim_feedforward,
+                dropout_rate=act_dropout,
+                epsilon=1e-5,
+                activation=activation,
+                act_dropout_rate=0.0,
+                normalize_before=normalize_before,
+                linear1_weight_attr=weight_attrs[2],
+                linear1_bias_attr=bias_attrs[2],
+                linear2_weight_attr=output_layer_weight_attrs[2],
+                linear2_bias_attr=bias_attrs[2],
+            )
+        else:
+            self.linear1 = nn.Linear(d_model, dim_feedforward, weight_attrs[2], bias_attr=bias_attrs[2])
+            self.linear2 = nn.Linear(dim_feedforward, d_model, output_layer_weight_attrs[2], bias_attr=bias_attrs[2])
+            self.norm2 = nn.LayerNorm(d_model, epsilon=1e-5)
 
         self.norm1 = nn.LayerNorm(d_model, epsilon=1e-5)
-        self.norm2 = nn.LayerNorm(d_model, epsilon=1e-5)
         if not self.use_fused_dropout_add:
             self.dropout1 = nn.Dropout(dropout, mode="upscale_in_train")
             self.dropout2 = nn.Dropout(act_dropout, mode="upscale_in_train")
@@ -502,8 +657,16 @@ class TransformerDecoderLayer(nn.Layer):
 
     def forward(self, tgt, memory, tgt_mask=None, use_cache=False, cache=None):
 
-        auto.shard_tensor(self.linear1.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
-        auto.shard_tensor(self.linear2.weight, auto_env.get_mesh()[self.ipp], [auto_env.get_mesh().mp_dim, None])
+        if self.use_fused_ffn:
+            auto.shard_tensor(
+                self.ffn._linear1_weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim]
+            )
+            auto.shard_tensor(
+                self.ffn._linear2_weight, auto_env.get_mesh()[self.ipp], [auto_env.get_mesh().mp_dim, None]
+            )
+        else:
+            auto.shard_tensor(self.linear1.weight, auto_env.get_mesh()[self.ipp], [None, auto_env.get_mesh().mp_dim])
+            auto.shard_tensor(self.linear2.weight, auto_env.get_mesh()[self.ipp], [auto_env.get_mesh().mp_dim, None])
 
         residual = tgt
 
@@ -527,13 +690,29 @@ class TransformerDecoderLayer(nn.Layer):
             # TODO(JZ-LIANG) make sure unsharded annotation would not be changed
             auto.shard_tensor(tgt, auto_env.get_mesh()[self.ipp], [auto_env.get_mesh().sp_dim, auto_env.get_mesh().dp_dim, None])
 
-        if not self.use_fused_dropout_add:
-            tgt = residual + self.dropout1(tgt)
+        if self.use_fused_dropout_residual_ln:
+            tgt = fused_bias_dropout_residual_layer_norm(
+                tgt,
+                residual,
+                ln_scale=self.norm1.weight,
+                ln_bias=self.norm1.bias,
+                dropout_rate=self.dropout_rate,
+                ln_epsilon=self.norm1._epsilon,
+                training=self.training,
+            )
         else:
-            tgt = self.fused_dropout_add1(tgt, residual)
+            if not self.use_fused_dropout_add:
+                tgt = residual + self.dropout1(tgt)
+            else:
+                tgt = self.fused_dropout_add1(tgt, residual)
 
-        if not self.normalize_before:
-            tgt = self.norm1(tgt)
+            if not self.normalize_before:
+                tgt = self.norm1(tgt)
+
+        if self.use_fused_ffn:
+            # layer_norm, dropout and residual add are all inside the fused op
+            tgt = self.ffn(tgt)
+            return tgt if use_cache is False else (tgt, incremental_cache)
 
         residual = tgt
         if self.normalize_before:
@@ -553,6 +732,17 @@ class TransformerDecoderLayer(nn.Layer):
                 tgt = residual + tgt
             else:
                 tgt = self.fused_dropout_add2(tgt, residual)
+        elif self.use_fused_dropout_residual_ln:
+            tgt = fused_bias_dropout_residual_layer_norm(
+                self.linear2(self.activation(self.linear1(tgt))),
+                residual,
+                ln_scale=self.norm2.weight,
+                ln_bias=self.norm2.bias,
+                dropout_rate=self.act_dropout_rate,
+                ln_epsilon=self.norm2._epsilon,
+                training=self.training,
+            )
+            return tgt if use_cache is False else (tgt, incremental_cache)
         else:
             # Mixed SP and TP Region
             if not self.use_fused_dropout_add:
@@ -609,9 +799,8 @@ class GPTEmbeddings(nn.Layer):
 
     def forward(self, input_ids, position_ids=None):
         if position_ids is None:
-            ones = paddle.ones_like(input_ids, dtype="int64")
-            seq_length = paddle.cumsum(ones, axis=-1)
-            position_ids = seq_length - ones
+            # [1, s] broadcasts against the [b, s, h] word embeddings
+            position_ids = paddle.arange(input_ids.shape[-1], dtype="int64").unsqueeze(0)
 
         auto.shard_tensor(self.word_embeddings.weight, auto_env.get_mesh()[0], [auto_env.get_mesh().mp_dim, None])
 
@@ -653,7 +842,10 @@ class GPTModelAuto(nn.Layer):
         use_flash_attn=False,
         fused_softmax_with_triangular=False,
         use_fused_dropout_add=True,
+        use_fused_ffn=False,
+        use_fused_dropout_residual_ln=False,
         sequence_parallel=False,
+        compute_dtype=None,
     ):
 
         super(GPTModelAuto, self).__init__()
@@ -675,6 +867,12 @@ class GPTModelAuto(nn.Layer):
             else:
                 use_flash_attn = False
                 logger.warning("Flash-attention is not support in this Paddle version.")
+        self.use_flash_attn = use_flash_attn
+
+        # name -> (dtype, tensor) of max_position_embeddings sized tensors sliced by every dygraph forward. Kept
+        # in a dict, a Tensor attribute of a Layer would be registered as a buffer.
+        self.max_position_embeddings = max_position_embeddings
+        self._dygraph_buffers = {}
 
         self.embeddings = GPTEmbeddings(
             vocab_size,
@@ -689,6 +887,17 @@ class GPTModelAuto(nn.Layer):
 
         layer_per_stage = num_layers // auto_env.get_mesh().pp_degree
         layer_to_pipe = [i // layer_per_stage for i in range(num_layers)]
+        # parameter attrs are the same for every layer, convert them once and share them across layers
+        weight_attrs = _convert_param_attr_to_list(
+            paddle.ParamAttr(initializer=nn.initializer.Normal(mean=0.0, std=self.initializer_range)), 3
+        )
+        output_layer_weight_attrs = _convert_param_attr_to_list(
+            paddle.ParamAttr(
+                initializer=nn.initializer.Normal(mean=0.0, std=self.initializer_range / math.sqrt(2.0 * num_layers))
+            ),
+            3,
+        )
+        bias_attrs = _convert_param_attr_to_list(None, 3)
         decoder_layers = nn.LayerList()
         for i in range(num_layers):
             decoder_layers.append(
@@ -700,23 +909,20 @@ class GPTModelAuto(nn.Layer):
                     activation="gelu",
                     attn_dropout=attention_probs_dropout_prob,
                     act_dropout=hidden_dropout_prob,
-                    weight_attr=paddle.ParamAttr(
-                        initializer=nn.initializer.Normal(mean=0.0, std=self.initializer_range)
-                    ),
-                    output_layer_weight_attr=paddle.ParamAttr(
-                        initializer=nn.initializer.Normal(
-                            mean=0.0, std=self.initializer_range / math.sqrt(2.0 * num_layers)
-                        )
-                    ),
-                    bias_attr=None,
+                    weight_attr=weight_attrs,
+                    output_layer_weight_attr=output_layer_weight_attrs,
+                    bias_attr=bias_attrs,
                     fuse_attn_qkv=fuse_attn_qkv,
                     scale_qk_coeff=num_layers if scale_qk_by_layer_num else 1.0,
                     use_recompute=use_recompute,
                     recompute_granularity=recompute_granularity,
                     use_fused_dropout_add=use_fused_dropout_add,
+                    use_fused_ffn=use_fused_ffn,
+                    use_fused_dropout_residual_ln=use_fused_dropout_residual_ln,
                     use_flash_attn=use_flash_attn,
                     ipp=layer_to_pipe[i],
                     sequence_parallel=sequence_parallel,
+                    compute_dtype=compute_dtype,
                 )
             )
 
@@ -730,15 +936,38 @@ class GPTModelAuto(nn.Layer):
             sequence_parallel=sequence_parallel,
         )
 
+    def _get_position_ids(self, past_length, seq_length, dtype):
+        # Tensors built while converting to static graph belong to one program, so only cache in dygraph.
+        if not paddle.in_dynamic_mode():
+            return paddle.arange(past_length, seq_length + past_length, dtype=dtype).unsqueeze(0)
+        # One max length arange is sliced for every step instead of keeping position ids per length.
+        if self._dygraph_buffers.get("position_ids", (None,))[0] != dtype:
+            position_ids = paddle.arange(self.max_position_embeddings, dtype=dtype).unsqueeze(0)
+            self._dygraph_buffers["position_ids"] = (dtype, position_ids)
+        return self._dygraph_buffers["position_ids"][1][:, past_length : past_length + seq_length]
+
+    def _get_causal_mask(self, seq_length):
+        # Tensors built while converting to static graph belong to one program, build it there at the actual length.
+        if not paddle.in_dynamic_mode():
+            return paddle.tensor.triu(paddle.full((seq_length, seq_length), -1e4), diagonal=1)
+        # Allocated by the first forward that needs it, so flash-attention and fused-softmax runs never build it.
+        # One max length mask is sliced for every length instead of keeping a mask per length.
+        dtype = paddle.get_default_dtype()
+        if self._dygraph_buffers.get("causal_mask", (None,))[0] != dtype:
+            size = self.max_position_embeddings
+            causal_mask = paddle.tensor.triu(paddle.full((size, size), -1e4), diagonal=1)
+            causal_mask.stop_gradient = True
+            self._dygraph_buffers["causal_mask"] = (dtype, causal_mask)
+        return self._dygraph_buffers["causal_mask"][1][:seq_length, :seq_length]
+
     def forward(self, input_ids, position_ids=None, attention_mask=None, use_cache=False, cache=None):
 
         if position_ids is None:
             past_length = 0
             if cache is not None:
                 past_length = attention_mask.shape[-1] - 1
-            position_ids = paddle.arange(past_length, input_ids.shape[-1] + past_length, dtype=input_ids.dtype)
-            position_ids = position_ids.unsqueeze(0)
-            position_ids = paddle.expand_as(position_ids, input_ids)
+            # [1, s], the position embeddings broadcast over the batch in GPTEmbeddings
+            position_ids = self._get_position_ids(past_length, input_ids.shape[-1], input_ids.dtype)
 
         input_ids.stop_gradient = True
         position_ids.stop_gradient = True
@@ -748,28 +977,36 @@ class GPTModelAuto(nn.Layer):
 
         embedding_output = self.embeddings(input_ids=input_ids, position_ids=position_ids)
 
+        # The causal mask is applied inside the kernel by flash-attention (no user mask and no cache)
+        # or by softmax_mask_fuse_upper_triangle (fused_softmax_with_triangular in training, or whenever
+        # the mask would be the plain causal one).
+        causal_in_kernel = (self.use_flash_attn and attention_mask is None and not use_cache) or (
+            self.fused_softmax_with_triangular
+            and paddle.is_compiled_with_cuda()
+            and (self.training or (attention_mask is None and not use_cache))
+        )
+
         # fused_softmax_with_triangular is only suppported on GPU/DCU.
         # If on non-GPU devices, we use user defined mask and non-fused softmax.
-        if not self.fused_softmax_with_triangular or not paddle.is_compiled_with_cuda():
-            # TODO, use registered buffer
-            causal_mask = paddle.tensor.triu(
-                paddle.ones((input_ids.shape[-1], input_ids.shape[-1])) * -1e4, diagonal=1
-            )
+        if not causal_in_kernel and (not self.fused_softmax_with_triangular or not paddle.is_compiled_with_cuda()):
+            causal_mask = self._get_causal_mask(input_ids.shape[-1])
             if attention_mask is not None:
                 if len(attention_mask.shape) == 2:
                     attention_mask = attention_mask[:, None, None, :]
                 attention_mask = attention_mask + causal_mask
             else:
+                # No user mask to combine with, so the [s, s] causal mask is used as is, in the compute
+                # dtype (-1e4 is representable in fp16 and bf16).
                 attention_mask = causal_mask
+                if attention_mask.dtype != embedding_output.dtype:
+                    attention_mask = paddle.cast(attention_mask, embedding_output.dtype)
             # The tensor returned by triu not in static graph.
             attention_mask.stop_gradient = True
 
         encoder_outputs = self.decoder(
             embedding_output,
             memory=None,
-            tgt_mask=None
-            if (self.fused_softmax_with_triangular and self.training and paddle.is_compiled_with_cuda())
-            else attention_mask,  # use softmax_mask_fuse_upper_triangle
+            tgt_mask=None if causal_in_kernel else attention_mask,
             use_cache=use_cache,
             cache=cache,
         )
@@ -858,13 +1095,16 @@ class GPTPretrainingCriterionAuto(nn.Layer):
             loss_mask, auto_env.get_mesh()[-1], [auto_env.get_mesh().dp_dim] + [None] * (len(loss_mask.shape) - 1)
         )
         if self.sequence_parallel:
-            # [s, b, h] --> [b, s, h]
-            prediction_scores = prediction_scores.transpose([1, 0, 2])
+            # The logits stay [s, b, v], the much smaller labels and mask are moved to [s, b] instead,
+            # the masked sum does not depend on the layout.
+            masked_lm_labels = masked_lm_labels.transpose([1, 0])
+            loss_mask = loss_mask.transpose([1, 0])
 
         masked_lm_loss = self.loss_func(prediction_scores, masked_lm_labels.unsqueeze(2))
 
-        loss_mask = loss_mask.reshape([-1])
-        masked_lm_loss = paddle.sum(masked_lm_loss.reshape([-1]) * loss_mask)
+        # [b, s, 1] --> [b, s] ([s, b] under sequence parallel), mask and reduce the loss in place of
+        # flattening both tensors
+        masked_lm_loss = paddle.sum(masked_lm_loss.squeeze(-1) * loss_mask)
 
         loss = masked_lm_loss / loss_mask.sum()
         return loss
@@ -889,6 +1129,7 @@ class GPTForGenerationAuto(nn.Layer):
         self.min_length = self.configs.get("min_dec_len", 0)
         self.decode_strategy = self.configs.get("decode_strategy", "sampling")
         self.early_finish = self.configs.get("early_finish", True)
+        self.early_finish_interval = self.configs.get("early_finish_interval", 8)
         self.temperature = self.configs.get("temperature", 1.0)
         self.top_k = self.configs.get("top_k", 0)
         self.top_p = self.configs.get("top_p", 1.0)
@@ -909,6 +1150,20 @@ class GPTForGenerationAuto(nn.Layer):
         self.diversity_rate = self.configs.get("diversity_rate", 0.0)
         self.use_cache = self.configs.get("use_cache", True)
 
+        # fall back to the token ids defined on the backbone once here instead of on every forward
+        for name in [
+            "bos_token_id",
+            "eos_token_id",
+            "pad_token_id",
+            "decoder_start_token_id",
+            "forced_bos_token_id",
+            "forced_eos_token_id",
+        ]:
+            if getattr(self, name) is None:
+                setattr(self, name, getattr(self.gpt, name, None))
+        # logits processors only depend on the resolved lengths, reused across calls in dygraph
+        self._logits_processors_cache = {}
+
     def prepare_input_ids_for_generation(self, bos_token_id, encoder_output=None):
         batch_size = 1
         if bos_token_id is None:
@@ -918,13 +1173,12 @@ class GPTForGenerationAuto(nn.Layer):
         return paddle.ones([batch_size, 1], dtype="int64") * bos_token_id
 
     def prepare_attention_mask_for_generation(self, input_ids, pad_token_id, eos_token_id):
-        is_pad_token_in_inputs_ids = (pad_token_id is not None) and paddle.any(
-            input_ids == pad_token_id
-        ).item()
+        # The mask built from pad positions is all zeros when there is no pad token in input_ids,
+        # so it is built directly rather than syncing `paddle.any(input_ids == pad_token_id)` to host.
         is_pad_token_not_equal_to_eos_token_id = (eos_token_id is None) or (
             (eos_token_id is not None) and (pad_token_id != eos_token_id)
         )
-        if is_pad_token_in_inputs_ids and is_pad_token_not_equal_to_eos_token_id:
+        if pad_token_id is not None and is_pad_token_not_equal_to_eos_token_id:
             attention_mask = (input_ids == pad_token_id).astype(paddle.get_default_dtype()) * -1e9
         else:
             attention_mask = paddle.zeros_like(input_ids, dtype=paddle.get_default_dtype())
@@ -951,7 +1205,24 @@ class GPTForGenerationAuto(nn.Layer):
     ):
         processors = LogitsProcessorList()
 
-        if min_length is not None and eos_token_id is not None and min_length > -1:
+        use_min_length = min_length is not None and eos_token_id is not None and min_length > -1
+        use_repetition_penalty = repetition_penalty is not None and repetition_penalty != 1.0
+        if num_beam_groups <= 1 or diversity_rate <= 0.0:
+            # without hamming diversity, which has to run in between, one processor call handles all of them
+            if use_min_length or use_repetition_penalty or forced_bos_token_id is not None or forced_eos_token_id is not None:
+                processors.append(
+                    FusedLogitsProcessor(
+                        min_length=min_length if use_min_length else None,
+                        eos_token_id=eos_token_id,
+                        repetition_penalty=repetition_penalty if use_repetition_penalty else None,
+                        forced_bos_token_id=forced_bos_token_id,
+                        max_length=max_length,
+                        forced_eos_token_id=forced_eos_token_id,
+                    )
+                )
+            return processors
+
+        if use_min_length:
             processors.append(MinLengthLogitsProcessor(min_length, eos_token_id))
         if num_beam_groups > 1 and diversity_rate > 0.0:
             processors.append(
@@ -959,7 +1230,7 @@ class GPTForGenerationAuto(nn.Layer):
                     diversity_rate=diversity_rate, num_beams=num_beams, num_beam_groups=num_beam_groups
                 )
             )
-        if repetition_penalty is not None and repetition_penalty != 1.0:
+        if use_repetition_penalty:
             processors.append(RepetitionPenaltyLogitsProcessor(penalty=repetition_penalty))
         if forced_bos_token_id is not None:
             processors.append(ForcedBOSTokenLogitsProcessor(forced_bos_token_id))
@@ -971,39 +1242,26 @@ class GPTForGenerationAuto(nn.Layer):
         return processors
 
     def expand_inputs_for_generation(self, input_ids, expand_size, attention_mask=None, **model_kwargs):
-
-        index = paddle.tile(paddle.arange(input_ids.shape[0]).unsqueeze(-1), [1, expand_size]).reshape([-1])
-
-        input_ids = paddle.gather(input_ids, index)
+        # repeat_interleave copies each sample `expand_size` times along the batch axis directly,
+        # no int64 gather index has to be built
+        input_ids = paddle.repeat_interleave(input_ids, expand_size, axis=0)
 
         if attention_mask is not None:
-            model_kwargs["attention_mask"] = paddle.gather(attention_mask, index)
+            model_kwargs["attention_mask"] = paddle.repeat_interleave(attention_mask, expand_size, axis=0)
 
-        if "token_type_ids" in model_kwargs and model_kwargs["token_type_ids"] is not None:
-            token_type_ids = model_kwargs["token_type_ids"]
-            model_kwargs["token_type_ids"] = paddle.gather(token_type_ids, index)
-
-        if "position_ids" in model_kwargs and model_kwargs["position_ids"] is not None:
-            position_ids = model_kwargs["position_ids"]
-            model_kwargs["position_ids"] = paddle.gather(position_ids, index)
-
-        if "seq_len" in model_kwargs and model_kwargs["seq_len"] is not None:
-            seq_len = model_kwargs["seq_len"]
-            model_kwargs["seq_len"] = paddle.gather(seq_len, index)
-
-        if "encoder_output" in model_kwargs and model_kwargs["encoder_output"] is not None:
-            encoder_output = model_kwargs["encoder_output"]
-            model_kwargs["encoder_output"] = paddle.gather(encoder_output, index)
-
-        if "role_ids" in model_kwargs and model_kwargs["role_ids"] is not None:
-            role_ids = model_kwargs["role_ids"]
-            model_kwargs["role_ids"] = paddle.gather(role_ids, index)
+        for key in ["token_type_ids", "position_ids", "seq_len", "encoder_output", "role_ids"]:
+            if key in model_kwargs and model_kwargs[key] is not None:
+                model_kwargs[key] = paddle.repeat_interleave(model_kwargs[key], expand_size, axis=0)
 
         return input_ids, model_kwargs
 
     def prepare_inputs_for_generation(self, input_ids, use_cache=False, cache=None, **kwargs):
         # only last token for inputs_ids if cache is defined in kwargs
         position_ids = kwargs.get("position_ids", None)
+        if cache is not None:
+            input_ids = input_ids[:, -1:]
+            if position_ids is not None:
+                position_ids = position_ids[:, -1:]
         attention_mask = kwargs.get("attention_mask", None)
         if attention_mask is not None:
             if len(attention_mask.shape) == 4:
@@ -1036,19 +1294,22 @@ class GPTForGenerationAuto(nn.Layer):
         # update attention_mask
         if not is_encoder_decoder and "attention_mask" in model_kwargs:
             attention_mask = model_kwargs["attention_mask"]
-            # nn.Pad2D don't support the data type `bool`
             if convert_dtype(attention_mask.dtype) == "bool":
                 attention_mask = paddle.cast(attention_mask, "int64")
             if len(attention_mask.shape) == 4:
-                attention_mask = nn.Pad2D([0, 0, 0, 1], mode="replicate")(attention_mask)
-                attention_mask = nn.Pad2D([0, 1, 0, 0], value=-1e4)(attention_mask)
                 dtype = convert_dtype(attention_mask.dtype)
                 if "int" in dtype:
-                    attention_mask[:, :, -1, -1] = 1
+                    fill_value = 1
                 elif "float" in dtype:
-                    attention_mask[:, :, -1, -1] = 0.0
+                    fill_value = 0.0
                 else:
                     raise ValueError("The data type of input `attention_mask` must " "be bool, int or float")
+                # Only the last query row is read by `prepare_inputs_for_generation`, so keep that row
+                # and append the new visible column in one concat instead of padding rows and columns.
+                last_row = attention_mask[:, :, -1:, :]
+                attention_mask = paddle.concat(
+                    [last_row, paddle.full_like(last_row[:, :, :, -1:], fill_value)], axis=-1
+                )
             else:
                 attention_mask = paddle.concat(
                     [attention_mask, paddle.ones([attention_mask.shape[0], 1], dtype="int64")], axis=-1
@@ -1060,7 +1321,9 @@ class GPTForGenerationAuto(nn.Layer):
             role_ids = model_kwargs["role_ids"]
             model_kwargs["role_ids"] = paddle.concat([role_ids, role_ids[:, -1:]], axis=-1)
 
-        model_kwargs["res"] = paddle.concat([model_kwargs["res"], next_tokens], axis=1)
+        # dygraph writes the generated ids into the preallocated buffer in `sample`
+        if not paddle.in_dynamic_mode():
+            model_kwargs["res"] = paddle.concat([model_kwargs["res"], next_tokens], axis=1)
 
         return model_kwargs
 
@@ -1081,32 +1344,34 @@ class GPTForGenerationAuto(nn.Layer):
             top_k = min(max(top_k, min_tokens_to_keep), probs.shape[-1])
             # Remove all tokens with a probability less than the last token of the top-k
             topk_probs, _ = paddle.topk(probs, k=top_k)
-            probs = paddle.where(probs >= topk_probs[:, -1:], probs, paddle.full_like(probs, 0.0))
+            # one elementwise multiply by the keep mask, no zero tensor of the vocab size
+            probs = probs * paddle.cast(probs >= topk_probs[:, -1:], probs.dtype)
             return probs
 
+        def TopKLogitsProcess(logits, top_k, min_tokens_to_keep):
+            top_k = min(max(top_k, min_tokens_to_keep), logits.shape[-1])
+            # Tokens outside the top-k get -inf so they can never win the Gumbel-max argmax
+            topk_logits, _ = paddle.topk(logits, k=top_k)
+            return paddle.where(logits >= topk_logits[:, -1:], logits, paddle.full_like(logits, float("-inf")))
+
         def TopPProcess(probs, top_p, min_tokens_to_keep):
-            sorted_probs = paddle.sort(probs, descending=True)
+            # sort once and gather the sorted probs instead of running sort and argsort separately
             sorted_indices = paddle.argsort(probs, descending=True)
+            sorted_probs = paddle.take_along_axis(probs, sorted_indices, axis=-1)
             cumulative_probs = paddle.cumsum(sorted_probs, axis=-1)
 
             # Remove tokens with cumulative probs above the top_p, But keep at
-            # least min_tokens_to_keep tokens
-            sorted_indices_to_remove = cumulative_probs > top_p
+            # least min_tokens_to_keep tokens. Comparing the cumulative probs before
+            # each token keeps the first token and the one crossing top_p.
+            sorted_indices_to_remove = (cumulative_probs - sorted_probs) > top_p
             if min_tokens_to_keep > 1:
-                # Set 'min_tokens_to_keep - 1' because the first token is kept
-                sorted_indices_to_remove[:, : min_tokens_to_keep - 1] = 0
-            # Keep the first token
-            sorted_indices_to_remove = paddle.cast(sorted_indices_to_remove, dtype="int64")
-            sorted_indices_to_remove[:, 1:] = sorted_indices_to_remove[:, :-1].clone()
-            sorted_indices_to_remove[:, 0] = 0
-
-            # Scatter sorted tensors to original indexing
-            sorted_indices = sorted_indices + paddle.arange(probs.shape[0]).unsqueeze(-1) * probs.shape[-1]
-            condition = paddle.scatter(
-                sorted_indices_to_remove.flatten(), sorted_indices.flatten(), sorted_indices_to_remove.flatten()
-            )
-            condition = paddle.cast(condition, "bool").reshape(probs.shape)
-            probs = paddle.where(condition, paddle.full_like(probs, 0.0), probs)
+                sorted_indices_to_remove = paddle.logical_and(
+                    sorted_indices_to_remove, paddle.arange(probs.shape[-1]) >= min_tokens_to_keep
+                )
+
+            # Scatter the filtered sorted probs back to the original indexing
+            sorted_probs = sorted_probs * paddle.cast(paddle.logical_not(sorted_indices_to_remove), probs.dtype)
+            probs = paddle.put_along_axis(probs, sorted_indices, sorted_probs, axis=-1)
             return probs
 
         batch_size, cur_len = input_ids.shape
@@ -1120,9 +1385,30 @@ class GPTForGenerationAuto(nn.Layer):
         unfinished_flag = paddle.full([batch_size, 1], True, dtype="bool")
         scores = paddle.full([batch_size, 1], 0.0, dtype=paddle.get_default_dtype())
 
-        res = paddle.assign(input_ids)
+        # In dygraph the generated ids are written into a buffer of the final length instead of concatenating
+        # every step. dy2static keeps the concat, an in-place write at tensor offsets is not a safe loop var.
+        if paddle.in_dynamic_mode():
+            res = paddle.full(
+                [batch_size, max_length], pad_token_id if pad_token_id is not None else 0, dtype=input_ids.dtype
+            )
+            res[:, :origin_len] = input_ids
+        else:
+            res = paddle.assign(input_ids)
         model_kwargs["res"] = res
 
+        # constant tensors used by every step are created once here instead of inside _post_process_
+        if top_p is not None and top_p < 1.0 and self.use_topp_sampling:
+            top_ps_tensor = paddle.full(shape=[batch_size], fill_value=top_p, dtype=paddle.get_default_dtype())
+            # probs dtype -> top_ps_tensor in that dtype, filled by the pre-loop step so the loop never casts it
+            top_ps_tensors = {}
+
+        # the tied lm head weight and its sharded matmul do not change across steps
+        word_embeddings_weight = get_attr(self.gpt.embeddings.word_embeddings, "weight")
+        # logits are [batch_size, 1, hidden_size] in every step
+        x_dims_mapping = [auto_env.get_mesh().dp_dim, None, None]
+        w_dims_mapping = [auto_env.get_mesh().mp_dim, None]
+        matmul = auto.shard_op(paddle.matmul, auto_env.get_mesh()[-1], [x_dims_mapping, w_dims_mapping, None])
+
         # use_cache is immutable, we split it off other mutable kwargs.
         assert "use_cache" in model_kwargs
         immutable = {"use_cache": model_kwargs["use_cache"]}
@@ -1132,15 +1418,14 @@ class GPTForGenerationAuto(nn.Layer):
             model_inputs = self.prepare_inputs_for_generation(input_ids, **args, **immutable)
             return self.gpt(**model_inputs, **immutable)
 
-        def _post_process_(outputs, input_ids, cur_len, origin_len, scores, unfinished_flag, model_kwargs):
+        def _post_process_(outputs, input_ids, cur_len, origin_len, scores, unfinished_flag, model_kwargs, res_len):
 
             logits = outputs[0] if isinstance(outputs, tuple) else outputs
+            # only the last position is sampled, project it alone onto the vocab
+            logits = logits[:, -1:, :]
 
-            x_dims_mapping = [auto_env.get_mesh().dp_dim] + [None] * (len(logits.shape) - 1)
-            w_dims_mapping = [auto_env.get_mesh().mp_dim, None]
-            matmul = auto.shard_op(paddle.matmul, auto_env.get_mesh()[-1], [x_dims_mapping, w_dims_mapping, None])
             with paddle.base.name_scope("skip_quant"):
-                logits = matmul(logits, get_attr(self.gpt.embeddings.word_embeddings, "weight"), transpose_y=True)
+                logits = matmul(logits, word_embeddings_weight, transpose_y=True)
 
             # [batch_size, vocab_size]
             logits = logits[:, -1, :]
@@ -1149,17 +1434,14 @@ class GPTForGenerationAuto(nn.Layer):
             logits = logits_processors(input_ids, logits)
 
             # sample
-            origin_probs = F.softmax(logits)
-            if temperature is None or temperature == 1.0:
-                probs = paddle.assign(origin_probs)
-                origin_probs = paddle.log(origin_probs)
-            else:
-                origin_probs = paddle.log(origin_probs)
+            # the log-probs used for scores come from a single log_softmax, no softmax + copy + log
+            origin_probs = F.log_softmax(logits)
+            if temperature is not None and temperature != 1.0:
                 logits = logits / temperature
-                probs = F.softmax(logits)
-            if top_k is not None and top_k != 0:
-                probs = TopKProcess(probs, top_k, min_tokens_to_keep)
             if top_p is not None and top_p < 1.0:
+                probs = F.softmax(logits)
+                if top_k is not None and top_k != 0:
+                    probs = TopKProcess(probs, top_k, min_tokens_to_keep)
                 if self.use_topp_sampling:
                     try:
                         from ppfleetx_ops import topp_sampling
@@ -1167,21 +1449,25 @@ class GPTForGenerationAuto(nn.Layer):
                         raise ImportError(
                             "please install ppfleetx_ops by 'cd ppfleetx/ops && python setup_cuda.py install'!"
                         )
-                    top_ps_tensor = paddle.full(shape=[probs.shape[0]], fill_value=top_p, dtype=probs.dtype)
                     # TODO fake random seed here
                     # Users should set the random seed dynamically when inference
-                    _, next_tokens = topp_sampling(probs, top_ps_tensor, random_seed=100)
+                    if probs.dtype not in top_ps_tensors:
+                        top_ps_tensors[probs.dtype] = paddle.cast(top_ps_tensor, probs.dtype)
+                    _, next_tokens = topp_sampling(probs, top_ps_tensors[probs.dtype], random_seed=100)
                 else:
                     probs = TopPProcess(probs, top_p, min_tokens_to_keep)
-
-            if not self.use_topp_sampling:
-                next_tokens = paddle.multinomial(probs)
+                    next_tokens = paddle.multinomial(probs)
+            else:
+                # Without top-p no normalized distribution is needed, Gumbel-max samples straight from the
+                # logits: argmax(logits + g) with g = -log(-log(u)) draws from softmax(logits).
+                if top_k is not None and top_k != 0:
+                    logits = TopKLogitsProcess(logits, top_k, min_tokens_to_keep)
+                uniform = paddle.uniform(paddle.shape(logits), dtype="float32", min=0.0, max=1.0)
+                gumbel_noise = -paddle.log(-paddle.log(uniform))
+                next_tokens = paddle.argmax(paddle.cast(logits, "float32") + gumbel_noise, axis=-1, keepdim=True)
 
             next_scores = paddle.index_sample(origin_probs, next_tokens)
 
-            if eos_token_id is not None:
-                next_tokens = paddle.where(unfinished_flag, next_tokens, paddle.full_like(next_tokens, pad_token_id))
-
             scores = self.update_scores_for_generation(scores, next_scores, cur_len - origin_len, unfinished_flag)
 
             input_ids = next_tokens
@@ -1192,6 +1478,9 @@ class GPTForGenerationAuto(nn.Layer):
             model_kwargs = self.update_model_kwargs_for_generation(
                 next_tokens, outputs, model_kwargs, is_encoder_decoder=self.is_encoder_decoder
             )
+            if paddle.in_dynamic_mode():
+                # res_len is the host-side length, slicing with the cur_len tensor would copy it to host every step
+                model_kwargs["res"][:, res_len : res_len + 1] = next_tokens
 
             return input_ids, scores, unfinished_flag, model_kwargs
 
@@ -1200,7 +1489,7 @@ class GPTForGenerationAuto(nn.Layer):
         outputs = _forward_(**model_kwargs)
 
         input_ids, scores, unfinished_flag, model_kwargs = _post_process_(
-            outputs, input_ids, cur_len_gpu, origin_len_gpu, scores, unfinished_flag, model_kwargs
+            outputs, input_ids, cur_len_gpu, origin_len_gpu, scores, unfinished_flag, model_kwargs, cur_len
         )
         if not self.inference:
             cur_len += 1
@@ -1226,6 +1515,7 @@ class GPTForGenerationAuto(nn.Layer):
                 scores,
                 unfinished_flag,
                 model_kwargs,
+                cur_len,
             )
             if not self.inference:
                 cur_len += 1
@@ -1236,10 +1526,32 @@ class GPTForGenerationAuto(nn.Layer):
 
             # early finish should be True in generation scenes,
             # If users want to test the inference speed, you can just set it False.
-            if self.early_finish and not paddle.any(unfinished_flag):
+            # In dygraph the check copies the flag to host, so it only runs every `early_finish_interval`
+            # steps, finished sequences just keep producing pad tokens in between.
+            if (
+                self.early_finish
+                and (self.inference or (cur_len - origin_len) % self.early_finish_interval == 0)
+                and not paddle.any(unfinished_flag)
+            ):
                 break
 
-        return model_kwargs["res"][:, origin_len:], scores
+        if paddle.in_dynamic_mode():
+            res = model_kwargs["res"][:, origin_len:cur_len]
+            if self.early_finish and self.early_finish_interval > 1 and eos_token_id is not None:
+                # The finished check only ran every `early_finish_interval` steps, drop the columns generated
+                # after the step where every sequence had its eos, so the length matches a per-step check.
+                is_eos = res == eos_token_id
+                if paddle.all(paddle.any(is_eos, axis=1)):
+                    first_eos = paddle.argmax(paddle.cast(is_eos, "int64"), axis=1)
+                    res = res[:, : int(paddle.max(first_eos)) + 1]
+        else:
+            res = model_kwargs["res"][:, origin_len:]
+        if eos_token_id is not None:
+            # Tokens after the first eos are replaced by pad once here, rather than with a `where` on
+            # every step. unfinished_flag is still updated every step, so scores and early finish are unchanged.
+            is_eos = paddle.cast(res == eos_token_id, "int64")
+            res = paddle.where(paddle.cumsum(is_eos, axis=1) - is_eos > 0, paddle.full_like(res, pad_token_id), res)
+        return res, scores
 
     def forward(self, input_ids=None, **model_kwargs):
 
@@ -1270,21 +1582,6 @@ class GPTForGenerationAuto(nn.Layer):
             decode_strategy
         )
 
-        bos_token_id = bos_token_id if bos_token_id is not None else getattr(self.gpt, "bos_token_id", None)
-        eos_token_id = eos_token_id if eos_token_id is not None else getattr(self.gpt, "eos_token_id", None)
-        pad_token_id = pad_token_id if pad_token_id is not None else getattr(self.gpt, "pad_token_id", None)
-        forced_bos_token_id = (
-            forced_bos_token_id if forced_bos_token_id is not None else getattr(self.gpt, "forced_bos_token_id", None)
-        )
-        forced_eos_token_id = (
-            forced_eos_token_id if forced_eos_token_id is not None else getattr(self.gpt, "forced_eos_token_id", None)
-        )
-        decoder_start_token_id = (
-            decoder_start_token_id
-            if decoder_start_token_id is not None
-            else getattr(self.gpt, "decoder_start_token_id", None)
-        )
-
         # params check
         if input_ids is None:
             # Init `input_ids` with bos_token_id
@@ -1327,17 +1624,23 @@ class GPTForGenerationAuto(nn.Layer):
             max_len = max_length + input_len
             min_len = min_length + input_len
 
-        logits_processors = self.get_logits_processor(
-            min_length=min_len,
-            max_length=max_len,
-            eos_token_id=eos_token_id,
-            forced_bos_token_id=forced_bos_token_id,
-            forced_eos_token_id=forced_eos_token_id,
-            num_beams=num_beams,
-            num_beam_groups=num_beam_groups,
-            diversity_rate=diversity_rate,
-            repetition_penalty=repetition_penalty,
-        )
+        # the lengths are tensors in inference mode, where forward is only traced once
+        cache_key = None if self.inference else (min_len, max_len)
+        logits_processors = self._logits_processors_cache.get(cache_key, None)
+        if logits_processors is None:
+            logits_processors = self.get_logits_processor(
+                min_length=min_len,
+                max_length=max_len,
+                eos_token_id=eos_token_id,
+                forced_bos_token_id=forced_bos_token_id,
+                forced_eos_token_id=forced_eos_token_id,
+                num_beams=num_beams,
+                num_beam_groups=num_beam_groups,
+                diversity_rate=diversity_rate,
+                repetition_penalty=repetition_penalty,
+            )
+            if cache_key is not None:
+                self._logits_processors_cache[cache_key] = logits_processors
 
         if decode_strategy == "sampling":
             if num_return_sequences > 1:
@@ -34,6 +34,14 @@ MODEL_CLASSES = {
 }
 
 
+def get_compute_dtype(configs):
+    # the dtype the static program runs in once auto-parallel AMP has cast it
+    mix_precision = configs.get("Engine", {}).get("mix_precision", None) or {}
+    if not mix_precision.get("enable", False):
+        return "float32"
+    return mix_precision.get("dtype", "float16")
+
+
 class LanguageModuleAuto(BasicModule):
     def __init__(self, configs):
         self.nranks = paddle.distributed.get_world_size()
@@ -121,6 +129,7 @@ class GPTModuleAuto(LanguageModuleAuto):
     def get_model(self):
         model_setting = copy.deepcopy(self.configs.Model)
         model_setting.pop("module")
+        model_setting.setdefault("compute_dtype", get_compute_dtype(self.configs))
         model_name = model_setting.pop("name")
         tokenizer_class, pretrained_name = MODEL_CLASSES[model_name]
         self.tokenizer = tokenizer_class.from_pretrained(pretrained_name)
@@ -160,6 +169,7 @@ class GPTGenerationModuleAuto(BasicModule):
     def get_model(self):
         model_setting = copy.deepcopy(self.configs.Model)
         model_setting.pop("module")
+        model_setting.setdefault("compute_dtype", get_compute_dtype(self.configs))
         model_name = model_setting.pop("name")
         tokenizer_class, pretrained_name = MODEL_CLASSES[model_name]
         self.tokenizer = tokenizer_class.from_pretrained(pretrained_name)
@@ -211,4 +221,7 @@ class GPTGenerationModuleAuto(BasicModule):
         return inputs
 
     def input_spec(self):
-        return [InputSpec(shape=[None, None], name="input_ids", dtype="int64")]
+        # A fixed [batch_size, prompt_len] (the usual serving case) exports a program with concrete
+        # shapes, so shape computations before the decoding loop are folded at export time.
+        input_shape = self.generation_cfgs.get("input_shape", None) or [None, None]
+        return [InputSpec(shape=input_shape, name="input_ids", dtype="int64")]
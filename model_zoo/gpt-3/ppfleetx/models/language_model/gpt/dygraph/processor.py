@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import inspect
 from abc import ABC
 from typing import List
@@ -19,13 +20,20 @@ from typing import List
 import paddle
 
 
+@functools.lru_cache(maxsize=None)
+def _extra_call_args(processor_cls):
+    # arguments of `__call__` besides (self, input_ids, logits), inspected once per class
+    # rather than once per processor per generated token
+    return tuple(inspect.signature(processor_cls.__call__).parameters.keys())[3:]
+
+
 class LogitsProcessorList(List):
     def __call__(self, input_ids, logits, **kwargs):
         for processor in self:
-            processor_args = inspect.signature(processor.__call__).parameters
-            if len(processor_args) > 2:
+            extra_args = _extra_call_args(type(processor))
+            if len(extra_args) > 0:
                 assert all(
-                    arg in kwargs for arg in list(processor_args.keys())[2:]
+                    arg in kwargs for arg in extra_args
                 ), f"The parameters don't match for {processor.__class__}"
                 logits = processor(input_ids, logits, **kwargs)
             else:
@@ -152,8 +160,8 @@ class ForcedBOSTokenLogitsProcessor(LogitsProcessor):
     def __call__(self, input_ids, scores):
         cur_len = input_ids.shape[-1]
         if cur_len == 1:
-            num_tokens = scores.shape[1]
-            scores[:, [i for i in range(num_tokens) if i != self.forced_bos_token_id]] = -float("inf")
+            # fill the whole row at once instead of indexing every other token id
+            scores = paddle.full_like(scores, -float("inf"))
             scores[:, self.forced_bos_token_id] = 0
         return scores
 
@@ -173,9 +181,65 @@ class ForcedEOSTokenLogitsProcessor(LogitsProcessor):
     def __call__(self, input_ids, scores):
         cur_len = input_ids.shape[-1]
         if cur_len == self.max_length - 1:
-            num_tokens = scores.shape[1]
-            scores[
-                :, [i for i in range(num_tokens) if i != self.forced_eos_token_id]
-            ] = -1e9  # TODO change back to -inf after paddle.topk is fixed
+            scores = paddle.full_like(scores, -1e9)  # TODO change back to -inf after paddle.topk is fixed
             scores[:, self.forced_eos_token_id] = 0
         return scores
+
+
+class FusedLogitsProcessor(LogitsProcessor):
+    r"""
+    Applies min-length, repetition penalty, forced BOS and forced EOS in a single
+    processor call, with the same semantics and order as chaining
+    `MinLengthLogitsProcessor`, `RepetitionPenaltyLogitsProcessor`,
+    `ForcedBOSTokenLogitsProcessor` and `ForcedEOSTokenLogitsProcessor`.
+    Args:
+        min_length (int, optional): The minimum length of generation sequence.
+        eos_token_id (int, optional): The id of the `end-of-sequence` token.
+        repetition_penalty (float, optional): The parameter for repetition penalty.
+        forced_bos_token_id (int, optional): The id of the token to be generated as the first token.
+        max_length (int, optional): The maximum length of the sequence to be generated.
+        forced_eos_token_id (int, optional): The id of the token to be generated as the last token.
+    """
+
+    def __init__(
+        self,
+        min_length=None,
+        eos_token_id=None,
+        repetition_penalty=None,
+        forced_bos_token_id=None,
+        max_length=None,
+        forced_eos_token_id=None,
+    ):
+        if min_length is not None:
+            if not isinstance(min_length, int) or min_length < 0:
+                raise ValueError("`min_length` should be a positive integer, but get {}".format(min_length))
+            if not isinstance(eos_token_id, int) or eos_token_id < 0:
+                raise ValueError("`eos_token_id` should be a positive integer, but get {}".format(eos_token_id))
+        if repetition_penalty is not None and (
+            not isinstance(repetition_penalty, float) or not (repetition_penalty > 0)
+        ):
+            raise ValueError(f"`penalty` has to be a strictly positive float, but is {repetition_penalty}")
+
+        self.min_length = min_length
+        self.eos_token_id = eos_token_id
+        self.penalty = repetition_penalty
+        self.forced_bos_token_id = forced_bos_token_id
+        self.max_length = max_length
+        self.forced_eos_token_id = forced_eos_token_id
+
+    def __call__(self, input_ids, logits):
+        cur_len = input_ids.shape[-1]
+        if self.min_length is not None and cur_len < self.min_length:
+            logits[:, self.eos_token_id] = -float("inf")
+        if self.penalty is not None:
+            # gather and write back along the vocab axis, no flattened offset indices
+            score = paddle.take_along_axis(logits, input_ids, axis=-1)
+            score = paddle.where(score < 0, score * self.penalty, score / self.penalty)
+            logits = paddle.put_along_axis(logits, input_ids, score, axis=-1)
+        if self.forced_bos_token_id is not None and cur_len == 1:
+            logits = paddle.full_like(logits, -float("inf"))
+            logits[:, self.forced_bos_token_id] = 0
+        if self.forced_eos_token_id is not None and cur_len == self.max_length - 1:
+            logits = paddle.full_like(logits, -1e9)  # TODO change back to -inf after paddle.topk is fixed
+            logits[:, self.forced_eos_token_id] = 0
+        return logits
@@ -12,15 +12,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain
 
+import aiohttp
 import erniebot
 import gradio as gr
+import numpy as np
 from prompt_utils import functions, get_parse_args
+from semantic_cache_utils import best_match
 
 from pipelines.document_stores import BaiduElasticsearchDocumentStore
 from pipelines.nodes import EmbeddingRetriever
-from pipelines.pipelines import Pipeline
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
 
 args = get_parse_args()
 erniebot.api_type = "qianfan"
@@ -46,81 +60,359 @@ dpr_retriever = EmbeddingRetriever(
     secret_key=args.embedding_secret_key,
 )
 
-pipeline = Pipeline()
-pipeline.add_node(component=dpr_retriever, name="DenseRetriever", inputs=["Query"])
 
+class SemanticCache:
+    """
+    Cache retrieval results by query embedding. A query reuses the documents of a cached query
+    when the cosine similarity of their embeddings reaches `threshold`, so paraphrased queries
+    skip the ANN search. Entries expire after `ttl` seconds and the least recently used entry
+    is evicted once a key holds `max_size` entries. Every key (e.g. each filtered paper title)
+    gets its own bucket, at most `max_buckets` of them are kept and the least recently used
+    bucket is dropped beyond that. The embeddings are kept as int8 with a per-vector scale,
+    a quarter of the float32 memory.
+    """
 
-def search_multi_paper(query, top_k=3):
-    prediction = pipeline.run(
-        query=query,
-        params={
-            "DenseRetriever": {
-                "top_k": top_k,
-                "index": args.abstract_index_name,
-            },
-        },
-    )
+    def __init__(self, threshold=0.95, max_size=1024, ttl=3600, max_buckets=64):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_buckets = max_buckets
+        # key -> {"embeddings": int8 [max_size, d], "scales": float32 [max_size], "documents": [...],
+        #         "created": [max_size], "accessed": [max_size], "size": int}, the first `size` rows are in use,
+        # ordered from the least to the most recently used key
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) + 1e-9)
+
+    @staticmethod
+    def _quantize(embedding):
+        # symmetric scalar quantization, embedding ~= quantized * scale
+        scale = np.float32(max(np.abs(embedding).max(), 1e-9) / 127.0)
+        return np.round(embedding / scale).astype(np.int8), scale
+
+    def _new_bucket(self, dim):
+        # allocated once at full capacity, inserts and evictions never reallocate the arrays
+        return {
+            "embeddings": np.empty((self.max_size, dim), dtype=np.int8, order="C"),
+            "scales": np.empty((self.max_size,), dtype=np.float32),
+            "documents": [None] * self.max_size,
+            "created": np.empty((self.max_size,), dtype=np.float64),
+            "accessed": np.empty((self.max_size,), dtype=np.float64),
+            "size": 0,
+        }
+
+    def _get_bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def _add_bucket(self, key, bucket):
+        self._buckets[key] = bucket
+        if len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return bucket
+
+    @staticmethod
+    def _remove(bucket, idx):
+        # move the last entry into the freed row so the rows in use stay packed
+        last = bucket["size"] - 1
+        for name in ["embeddings", "scales", "created", "accessed"]:
+            bucket[name][idx] = bucket[name][last]
+        bucket["documents"][idx] = bucket["documents"][last]
+        bucket["documents"][last] = None
+        bucket["size"] = last
+
+    def get(self, key, query_emb):
+        with self._lock:
+            bucket = self._get_bucket(key)
+            if bucket is None or bucket["size"] == 0:
+                return None
+            size = bucket["size"]
+            # embeddings are normalized on insertion, integer dot products rescaled by both scales
+            # give the cosine similarities
+            query_emb, query_scale = self._quantize(self._normalize(query_emb))
+            idx, sim = best_match(bucket["embeddings"][:size], bucket["scales"][:size], query_emb, query_scale)
+            idx = int(idx)
+            if sim < self.threshold:
+                return None
+            now = time.time()
+            if now - bucket["created"][idx] > self.ttl:
+                self._remove(bucket, idx)
+                return None
+            bucket["accessed"][idx] = now
+            return bucket["documents"][idx]
+
+    def put(self, key, query_emb, documents):
+        query_emb, query_scale = self._quantize(self._normalize(query_emb))
+        now = time.time()
+        with self._lock:
+            bucket = self._get_bucket(key)
+            if bucket is None:
+                bucket = self._add_bucket(key, self._new_bucket(query_emb.shape[-1]))
+            if bucket["size"] >= self.max_size:
+                self._remove(bucket, int(np.argmin(bucket["accessed"][: bucket["size"]])))
+            idx = bucket["size"]
+            bucket["embeddings"][idx] = query_emb
+            bucket["scales"][idx] = query_scale
+            bucket["created"][idx] = now
+            bucket["accessed"][idx] = now
+            bucket["documents"][idx] = documents
+            bucket["size"] = idx + 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class HNSWSemanticCache(SemanticCache):
+    """
+    SemanticCache backed by one hnswlib graph per key, a lookup walks the graph in O(log N)
+    instead of scanning every cached embedding, which pays off for large caches.
+    """
 
-    documents = []
-    for doc in prediction["documents"]:
-        documents.append(
-            {
-                "document": doc.content,
-                "key_words": doc.meta["key_words"],
-                "title": doc.meta["title"],
-            }
+    def __init__(self, threshold=0.95, max_size=1024, ttl=3600, max_buckets=64, ef_construction=200, M=16):
+        if hnswlib is None:
+            raise ImportError(
+                "hnswlib is required by the hnsw semantic cache, please install it by `pip install hnswlib`"
+            )
+        super().__init__(threshold=threshold, max_size=max_size, ttl=ttl, max_buckets=max_buckets)
+        self.ef_construction = ef_construction
+        self.M = M
+
+    def _remove(self, bucket, label):
+        bucket["index"].mark_deleted(label)
+        del bucket["documents"][label]
+        del bucket["created"][label]
+        del bucket["accessed"][label]
+
+    def get(self, key, query_emb):
+        with self._lock:
+            bucket = self._get_bucket(key)
+            if bucket is None or len(bucket["documents"]) == 0:
+                return None
+            labels, distances = bucket["index"].knn_query(self._normalize(query_emb)[None, :], k=1)
+            label = int(labels[0][0])
+            # the cosine space returns 1 - cosine similarity as distance
+            if 1.0 - distances[0][0] < self.threshold:
+                return None
+            now = time.time()
+            if now - bucket["created"][label] > self.ttl:
+                self._remove(bucket, label)
+                return None
+            bucket["accessed"][label] = now
+            return bucket["documents"][label]
+
+    def put(self, key, query_emb, documents):
+        query_emb = self._normalize(query_emb)
+        now = time.time()
+        with self._lock:
+            bucket = self._get_bucket(key)
+            if bucket is None:
+                index = hnswlib.Index(space="cosine", dim=query_emb.shape[-1])
+                index.init_index(
+                    max_elements=self.max_size,
+                    ef_construction=self.ef_construction,
+                    M=self.M,
+                    allow_replace_deleted=True,
+                )
+                # the graph of the least recently used key is released once max_buckets is exceeded
+                bucket = self._add_bucket(
+                    key,
+                    {
+                        "index": index,
+                        "documents": {},
+                        "created": {},
+                        "accessed": {},
+                        "next_label": 0,
+                    },
+                )
+            if len(bucket["documents"]) >= self.max_size:
+                self._remove(bucket, min(bucket["accessed"], key=bucket["accessed"].get))
+            label = bucket["next_label"]
+            bucket["next_label"] += 1
+            # the slot of an evicted entry is reused, the graph never grows beyond max_size
+            bucket["index"].add_items(query_emb[None, :], [label], replace_deleted=True)
+            bucket["documents"][label] = documents
+            bucket["created"][label] = now
+            bucket["accessed"][label] = now
+
+
+semantic_cache_class = HNSWSemanticCache if args.semantic_cache_index == "hnsw" else SemanticCache
+semantic_cache = semantic_cache_class(
+    threshold=args.semantic_cache_threshold,
+    max_size=args.semantic_cache_size,
+    ttl=args.semantic_cache_ttl,
+    max_buckets=args.semantic_cache_buckets,
+)
+
+
+def retrieve_documents(query, top_k, index, filters_json="null"):
+    # The query is embedded once, the same vector serves the cache lookup and the ANN search on a miss
+    query_emb = dpr_retriever.embed_queries([query])[0]
+    # filters_json is already canonical (sorted keys), so it keys the cache as is and is only decoded on a miss
+    cache_key = (index, top_k, filters_json)
+    documents = semantic_cache.get(cache_key, query_emb)
+    if documents is None:
+        docs = document_store_with_docs.query_by_embedding(
+            query_emb=query_emb, filters=json.loads(filters_json), top_k=top_k, index=index
         )
+        # an immutable tuple, the same object is shared by both cache layers and keys the json memo
+        documents = tuple(
+            [{"document": doc.content, "key_words": doc.meta["key_words"], "title": doc.meta["title"]} for doc in docs]
+        )
+        semantic_cache.put(cache_key, query_emb, documents)
+    return documents
+
+
+@lru_cache(maxsize=1024)
+def _search_documents_cached(query, top_k, index, filters_json, ttl_bucket):
+    # Exact repeats (e.g. a resubmitted question) are answered here without calling the embedding API.
+    # ttl_bucket advances every semantic_cache_ttl seconds, so results older than that are looked up again.
+    return retrieve_documents(query, top_k, index, filters_json=filters_json)
+
+
+# search key -> Future of the search currently running for it
+_inflight_searches = {}
+_inflight_lock = threading.Lock()
+
+
+def search_documents(query, top_k, index, filters_json="null"):
+    # filters arrive pre-encoded, the JSON string is both the cache key and what is decoded on a miss
+    key = (query, top_k, index, filters_json)
+    # Concurrent identical searches (e.g. several users asking the same question) wait for the one
+    # already in flight instead of each calling the embedding API and Elasticsearch.
+    with _inflight_lock:
+        future = _inflight_searches.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = _inflight_searches[key] = Future()
+    if not is_owner:
+        return future.result()
+
+    try:
+        documents = _search_documents_cached(*key, int(time.time() // args.semantic_cache_ttl))
+        future.set_result(documents)
+        return documents
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight_searches[key]
+
+
+# id(documents) -> (documents, json), the documents are kept to make sure the id is not reused
+_documents_json_memo = OrderedDict()
+
+
+def dumps_function_result(res):
+    """
+    Same output as `json.dumps(res, ensure_ascii=False)`, but the documents tuple of a cached search
+    result is only serialized the first time it is sent.
+    """
+    documents = res["documents"]
+    memo = _documents_json_memo.get(id(documents))
+    if memo is None or memo[0] is not documents:
+        memo = (documents, json.dumps(documents, ensure_ascii=False))
+        _documents_json_memo[id(documents)] = memo
+        if len(_documents_json_memo) > 1024:
+            _documents_json_memo.popitem(last=False)
+    else:
+        _documents_json_memo.move_to_end(id(documents))
+    items = [f'"documents": {memo[1]}']
+    items.extend(
+        f"{json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}"
+        for key, value in res.items()
+        if key != "documents"
+    )
+    return "{" + ", ".join(items) + "}"
+
+
+def clear_search_cache():
+    _search_documents_cached.cache_clear()
+    semantic_cache.clear()
+
+
+def search_multi_paper(query, top_k=3):
+    documents = search_documents(query, top_k, args.abstract_index_name)
     return {"documents": documents}
 
 
-def search_single_paper(query, title):
+@lru_cache(maxsize=1024)
+def _title_filters_json(title):
+    # encoded once per title, repeated questions about the same paper reuse the string. Only the
+    # encoding of the title is cached, it never goes stale and needs no ttl unlike the search results.
     filters = {
         "$and": {
             "title": {"$eq": title},
         }
     }
-    prediction = pipeline.run(
-        query=query,
-        params={
-            "DenseRetriever": {
-                "top_k": 3,
-                "index": args.full_text_index_name,
-                "filters": filters,
-            },
-        },
-    )
+    return json.dumps(filters, sort_keys=True, ensure_ascii=False)
 
-    documents = []
-    for doc in prediction["documents"]:
-        documents.append(
-            {
-                "document": doc.content,
-                "key_words": doc.meta["key_words"],
-                "title": doc.meta["title"],
-            }
-        )
 
+def search_single_paper(query, title):
+    documents = search_documents(query, 3, args.full_text_index_name, filters_json=_title_filters_json(title))
     return {"documents": documents}
 
 
-def history_transform(history=[]):
-    messages = []
-    if len(history) < 2:
-        return messages
+def history_transform(history=None):
+    if history is None or len(history) < 2:
+        return []
+
+    # the first turn is the greeting of the bot, flatten the remaining turns into user/assistant messages
+    return list(
+        chain.from_iterable(
+            ({"role": "user", "content": user}, {"role": "assistant", "content": assistant})
+            for user, assistant in history[1:]
+        )
+    )
+
+
+name2function = {"search_multi_paper": search_multi_paper, "search_single_paper": search_single_paper}
+# The retrieval tools block on http calls, they run in these threads so other sessions keep streaming
+# and independent tool calls of one turn overlap.
+tool_executor = ThreadPoolExecutor(max_workers=8)
+
+
+async def run_function_calls(function_calls):
+    loop = asyncio.get_running_loop()
+    func_args = [json.loads(function_call["arguments"]) for function_call in function_calls]
+    return await asyncio.gather(
+        *[
+            loop.run_in_executor(tool_executor, partial(name2function[function_call["name"]], **call_args))
+            for function_call, call_args in zip(function_calls, func_args)
+        ]
+    )
+
+
+_aiohttp_session = None
+
 
-    for turn_idx in range(1, len(history)):
-        messages.extend(
-            [{"role": "user", "content": history[turn_idx][0]}, {"role": "assistant", "content": history[turn_idx][1]}]
+def get_aiohttp_session():
+    # One keep-alive connection pool shared by every chat request instead of a new TLS connection per call,
+    # created lazily since the session has to be bound to the running event loop.
+    # Streamed answers can take longer than any fixed total, so only connecting and each read are bounded.
+    global _aiohttp_session
+    if _aiohttp_session is None or _aiohttp_session.closed:
+        _aiohttp_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=64),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60),
         )
-    return messages
+    return _aiohttp_session
 
 
-def prediction(history):
+async def prediction(history):
     logs = []
     query = history.pop()[0]
 
     if query == "":
-        return history, "注意：问题不能为空"
+        yield history, "注意：问题不能为空"
+        return
     for turn_idx in range(len(history)):
         if history[turn_idx][0] is not None:
             history[turn_idx][0] = history[turn_idx][0].replace("<br>", "")
@@ -131,14 +423,18 @@ def prediction(history):
     messages.append({"role": "user", "content": query})
     logs.append(f"Function Call的输入: {messages}")
     # Step 1, decide whether we need function call
-    resp_stream = erniebot.ChatCompletion.create(
-        model="ernie-bot-3.5", messages=messages, functions=functions, stream=True
+    resp_stream = await erniebot.ChatCompletion.acreate(
+        model="ernie-bot-3.5",
+        messages=messages,
+        functions=functions,
+        stream=True,
+        _config_={"aiohttp_session": get_aiohttp_session()},
     )
     # Step 2: execute command
     stream_output = ""
     output_response = ""
     function_flag = False
-    for resp in resp_stream:
+    async for resp in resp_stream:
         if not hasattr(resp, "function_call"):
             if not function_flag:
                 logs.append("Function Call未触发")
@@ -153,30 +449,34 @@ def prediction(history):
 
     # 2.1: execute function calling
     if hasattr(output_response, "function_call"):
-        function_call = output_response.function_call
-        logs.append(f"Function Call已触发: {function_call}")
-        name2function = {"search_multi_paper": search_multi_paper, "search_single_paper": search_single_paper}
-        func = name2function[function_call["name"]]
-        func_args = json.loads(function_call["arguments"])
-        res = func(**func_args)
-        # 对于多篇论文检索加入润色prompt
-        if function_call["name"] == "search_multi_paper":
-            res["prompt"] = "请根据论文检索工具的结果返回每篇论文的标题（加粗）, 内容以及关键词，使用自然语言的方式输出，不要使用json或者表格的形式。"
-        logs.append(f"Function Call调用结果: {res}")
-        # Step 3: return msg to erniebot
-        messages.append({"role": "assistant", "content": None, "function_call": function_call})
-        messages.append(
-            {"role": "function", "name": function_call["name"], "content": json.dumps(res, ensure_ascii=False)}
+        # a response carrying several calls is executed concurrently, otherwise it is the single call
+        function_calls = getattr(output_response, "function_calls", None) or [output_response.function_call]
+        logs.append(f"Function Call已触发: {function_calls}")
+        # show the triggered call right away, the search and the second completion take a while
+        yield history + [[query, None]], "\n".join(logs)
+        results = await run_function_calls(function_calls)
+        for function_call, res in zip(function_calls, results):
+            # 对于多篇论文检索加入润色prompt
+            if function_call["name"] == "search_multi_paper":
+                res["prompt"] = "请根据论文检索工具的结果返回每篇论文的标题（加粗）, 内容以及关键词，使用自然语言的方式输出，不要使用json或者表格的形式。"
+            logs.append(f"Function Call调用结果: {res}")
+            # Step 3: return msg to erniebot
+            messages.append({"role": "assistant", "content": None, "function_call": function_call})
+            messages.append({"role": "function", "name": function_call["name"], "content": dumps_function_result(res)})
+        response = await erniebot.ChatCompletion.acreate(
+            model="ernie-bot-3.5",
+            messages=messages,
+            stream=True,
+            _config_={"aiohttp_session": get_aiohttp_session()},
         )
-        response = erniebot.ChatCompletion.create(model="ernie-bot-3.5", messages=messages, stream=True)
         stream_output = ""
-        for character in response:
+        async for character in response:
             result = character["result"]
             stream_output += result
             yield history + [[query, stream_output]], "\n".join(logs)
 
     history.append([query, stream_output])
-    return history, "\n".join(logs)
+    yield history, "\n".join(logs)
 
 
 def add_message_chatbot(messages, history):
@@ -194,6 +494,7 @@ def launch_ui():
                 with gr.Row():
                     submit = gr.Button("🚀 提交", variant="primary", scale=1)
                     clear = gr.Button("清除", variant="primary", scale=1)
+                    clear_cache = gr.Button("清除检索缓存", variant="secondary", scale=1)
                 log = gr.Textbox(value="当前轮次日志")
             message.submit(add_message_chatbot, inputs=[message, chatbot], outputs=[message, chatbot]).then(
                 prediction, inputs=[chatbot], outputs=[chatbot, log]
@@ -202,6 +503,7 @@ def launch_ui():
                 prediction, inputs=[chatbot], outputs=[chatbot, log]
             )
             clear.click(lambda _: ([[None, "您好, 我是维普论文小助手"]]), inputs=[clear], outputs=[chatbot])
+            clear_cache.click(clear_search_cache)
     demo.queue()
     demo.launch(server_name=args.serving_name, server_port=args.serving_port, debug=True)
 
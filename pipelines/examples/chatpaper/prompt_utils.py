@@ -114,6 +114,30 @@ def get_parse_args():
     parser.add_argument("--embedding_api_key", default=None, type=str, help="The Embedding API Key.")
     parser.add_argument("--embedding_secret_key", default=None, type=str, help="The Embedding secret key.")
     parser.add_argument("--embed_title", default=False, type=bool, help="The title to be  embedded into embedding")
+    parser.add_argument(
+        "--semantic_cache_threshold",
+        default=0.95,
+        type=float,
+        help="The cosine similarity above which a query reuses the cached retrieval results of a similar query.",
+    )
+    parser.add_argument(
+        "--semantic_cache_size", default=1024, type=int, help="The max number of cached queries per index."
+    )
+    parser.add_argument(
+        "--semantic_cache_ttl", default=3600, type=int, help="The seconds a cached retrieval result stays valid."
+    )
+    parser.add_argument(
+        "--semantic_cache_buckets",
+        default=64,
+        type=int,
+        help="The max number of indexes and paper titles the semantic cache keeps entries for.",
+    )
+    parser.add_argument(
+        "--semantic_cache_index",
+        default="flat",
+        choices=["flat", "hnsw"],
+        help="How the semantic cache searches cached queries, flat scans all of them, hnsw needs hnswlib installed.",
+    )
     parser.add_argument("--serving_name", default="0.0.0.0", help="Serving ip.")
     parser.add_argument("--serving_port", default=8099, type=int, help="Serving port.")
     args = parser.parse_args()
@@ -0,0 +1,49 @@
+# Copyright (c) 2023 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def best_match_numpy(embeddings, scales, query_emb, query_scale):
+    # the int32 dot products are cast to float32 so the rescaling is not promoted to float64
+    sims = (embeddings @ query_emb.astype(np.int32)).astype(np.float32) * scales * query_scale
+    idx = int(np.argmax(sims))
+    return idx, sims[idx]
+
+
+if njit is not None:
+
+    # no fastmath "ninf"/"nnan" flags, the comparisons below must keep IEEE semantics
+    @njit(cache=True, fastmath={"contract", "reassoc"})
+    def best_match_numba(embeddings, scales, query_emb, query_scale):
+        # the dot products, rescaling and argmax in a single pass, no similarity array is materialized.
+        # Cosine similarities are at least -1, so -2.0 is a finite start below any of them.
+        best_idx, best_sim = -1, np.float32(-2.0)
+        for i in range(embeddings.shape[0]):
+            dot = 0
+            for k in range(embeddings.shape[1]):
+                dot += np.int32(embeddings[i, k]) * np.int32(query_emb[k])
+            sim = np.float32(dot) * scales[i] * query_scale
+            if sim > best_sim:
+                best_idx, best_sim = i, sim
+        return best_idx, best_sim
+
+    best_match = best_match_numba
+else:
+    best_match_numba = None
+    best_match = best_match_numpy
@@ -13,12 +13,139 @@
 # limitations under the License.
 
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional, Union
 
 from paddlenlp import Taskflow
 from pipelines.nodes.base import BaseComponent
 
 logger = logging.getLogger(__name__)
 
+# Shared ChatGLM predictors in the process, keyed by their Taskflow construction arguments
+_SHARED_TASKFLOWS = {}
+_SHARED_TASKFLOWS_LOCK = threading.Lock()
+
+
+class _SharedChatGLM:
+    """
+    One text2text_generation Taskflow together with the request queue and the worker thread that feed it.
+    Every call into the Taskflow goes through this object and is serialized by its lock, so bots sharing
+    the predictor never run it concurrently.
+    """
+
+    def __init__(self, max_batch_size, batch_wait_timeout, **taskflow_kwargs):
+        self.taskflow = Taskflow("text2text_generation", **taskflow_kwargs)
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout = batch_wait_timeout
+        self._run_lock = threading.Lock()
+        self._request_queue = queue.Queue()
+        self._batch_worker = None
+        self._batch_worker_lock = threading.Lock()
+        self._num_inflight = 0
+        self._closed = False
+        self._refs = 0
+
+    def __call__(self, inputs):
+        with self._run_lock:
+            return self.taskflow(inputs)
+
+    def submit(self, query):
+        """
+        Generate the answer of a single query. A query arriving while no other one is in flight runs
+        right away; concurrent queries are queued for the background worker, which merges them into
+        one generation call, and the caller blocks until its batch has been generated.
+        """
+        with self._batch_worker_lock:
+            if self._closed:
+                raise RuntimeError("The shared ChatGLM predictor has been closed")
+            self._num_inflight += 1
+            run_now = self._num_inflight == 1
+            if not run_now and self._batch_worker is None:
+                self._batch_worker = threading.Thread(target=self._batch_loop, daemon=True)
+                self._batch_worker.start()
+        try:
+            if run_now:
+                return {"result": [self([query])["result"][0]]}
+            future = Future()
+            self._request_queue.put((query, future))
+            return future.result()
+        finally:
+            with self._batch_worker_lock:
+                self._num_inflight -= 1
+
+    def close(self):
+        """
+        Stop the batch worker once the requests already queued have been served. Later submits are rejected.
+        """
+        with self._batch_worker_lock:
+            self._closed = True
+            if self._batch_worker is not None:
+                self._request_queue.put(None)
+                self._batch_worker = None
+
+    def _batch_loop(self):
+        stopped = False
+        while not stopped:
+            request = self._request_queue.get()
+            if request is None:
+                break
+            requests = [request]
+            deadline = time.monotonic() + self.batch_wait_timeout
+            while len(requests) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._request_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopped = True
+                    break
+                requests.append(request)
+            queries = [query for query, _ in requests]
+            try:
+                results = self(queries)["result"]
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(requests, results):
+                future.set_result({"result": [result]})
+
+
+def _get_shared_chatglm(max_batch_size, batch_wait_timeout, **taskflow_kwargs):
+    """
+    Load the text2text_generation Taskflow once per process and hand the same predictor to every caller
+    with identical arguments. The batching settings of the first caller apply to the shared queue. Note
+    that each server worker process still loads its own copy, so serve with a single worker and rely on
+    the dynamic batching for concurrency.
+    """
+    key = tuple(sorted((name, repr(value)) for name, value in taskflow_kwargs.items()))
+    with _SHARED_TASKFLOWS_LOCK:
+        if key not in _SHARED_TASKFLOWS:
+            _SHARED_TASKFLOWS[key] = _SharedChatGLM(max_batch_size, batch_wait_timeout, **taskflow_kwargs)
+        shared = _SHARED_TASKFLOWS[key]
+        shared._refs += 1
+        return shared
+
+
+def _release_shared_chatglm(shared):
+    """
+    Drop one reference to a shared predictor, stopping its worker and forgetting it when no bot uses it anymore.
+    """
+    with _SHARED_TASKFLOWS_LOCK:
+        shared._refs -= 1
+        if shared._refs > 0:
+            return
+        for key, value in list(_SHARED_TASKFLOWS.items()):
+            if value is shared:
+                del _SHARED_TASKFLOWS[key]
+    shared.close()
+
 
 class ChatGLMBot(BaseComponent):
     def __init__(
@@ -27,28 +154,55 @@ class ChatGLMBot(BaseComponent):
         batch_size: int = 2,
         max_seq_length: int = 2048,
         tgt_length: int = 2048,
+        dtype: str = "float16",
+        max_batch_size: int = 8,
+        batch_wait_timeout: float = 0.02,
         **kwargs
     ):
         """
         Initialize the ChatGLMBot instance.
 
-        :param batch_size: batch_size for chatglm prediction.
+        :param batch_size: batch_size for chatglm prediction, raised to max_batch_size if smaller.
         :param max_seq_length: max_seq_length for the processing input.
         :param tgt_length: tgt_length for models output
+        :param dtype: the dtype of the model weights and computation, "float16" or "bfloat16".
+        :param max_batch_size: max number of concurrent single queries merged into one generation call.
+        :param batch_wait_timeout: seconds to wait for more concurrent queries before running a batch.
         """
         self.kwargs = kwargs
-        self.chatglm = Taskflow(
-            "text2text_generation",
+        self.max_batch_size = max_batch_size
+        self.batch_wait_timeout = batch_wait_timeout
+        self.chatglm = _get_shared_chatglm(
+            max_batch_size,
+            batch_wait_timeout,
             model=model_name_or_path,
-            batch_size=batch_size,
+            batch_size=max(batch_size, max_batch_size),
             max_seq_length=max_seq_length,
             tgt_length=tgt_length,
+            dtype=dtype,
             **self.kwargs,
         )
 
+    def close(self):
+        """
+        Release the shared predictor; its batch worker is stopped when the last bot using it is closed.
+        """
+        if self.chatglm is not None:
+            _release_shared_chatglm(self.chatglm)
+            self.chatglm = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
     def predict(self, query, stream=False):
-        result = self.chatglm(query)
-        return result
+        # Batched inputs go straight to the model; concurrent single queries are
+        # coalesced by the background worker into one generation call.
+        if not isinstance(query, str) or self.max_batch_size <= 1:
+            return self.chatglm(query)
+        return self.chatglm.submit(query)
 
     def run(self, query, stream=False, **kwargs):
         """
@@ -61,3 +215,19 @@ class ChatGLMBot(BaseComponent):
             logger.debug(f"Query: {query}")
         result = self.predict(query=query, stream=stream)
         return result, "output_1"
+
+    def run_batch(self, queries: Optional[Union[str, List[str]]] = None, stream=False, **kwargs):
+        """
+        Using the chatbot to generate the answers for a list of queries in one call
+        :param queries: The user's inputs/queries to be sent to the chatGLM.
+        :param stream: Whether to use streaming mode when making the request. Currently not in use. Defaults to False.
+        """
+        if isinstance(queries, str):
+            queries = [queries]
+        elif not isinstance(queries, list):
+            raise ValueError("ChatGLMBot run_batch requires the `queries` parameter to be Union[str, List[str]]")
+        debug = kwargs.get("debug", False)
+        if debug:
+            logger.debug(f"Queries: {queries}")
+        result = self.chatglm(queries)
+        return result, "output_1"
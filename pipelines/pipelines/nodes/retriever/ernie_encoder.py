@@ -35,6 +35,9 @@ class ErnieEmbeddingEncoder(_BaseEmbeddingEncoder):
         self.secret_key = retriever.secret_key
         self.batch_size = min(16, retriever.batch_size)
         self.progress_bar = retriever.progress_bar
+        # Reuse keep-alive connections across embedding requests instead of a new TLS handshake per call
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=64))
         self.token = self._apply_token(self.api_key, self.secret_key)
         self._setup_encoding_models(retriever.embedding_model, retriever.max_seq_len)
 
@@ -52,7 +55,7 @@ class ErnieEmbeddingEncoder(_BaseEmbeddingEncoder):
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
         payload = ""
         token_host = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={api_key}&client_secret={secret_key}"
-        response = requests.request("POST", token_host, headers=headers, data=payload)
+        response = self.session.request("POST", token_host, headers=headers, data=payload)
 
         if response:
             res = response.json()
@@ -95,7 +98,7 @@ class ErnieEmbeddingEncoder(_BaseEmbeddingEncoder):
             self.token
         )
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = self.session.request("POST", url, headers=headers, data=payload)
             response_json = json.loads(response.text)
             embedding_data = response_json["data"]
         except Exception as e:
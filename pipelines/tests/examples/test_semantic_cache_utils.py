@@ -0,0 +1,57 @@
+# Copyright (c) 2023 PaddlePaddle Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "examples", "chatpaper"))
+
+try:
+    from semantic_cache_utils import best_match_numba, best_match_numpy
+except ImportError:
+    best_match_numba = best_match_numpy = None
+
+
+@unittest.skipIf(best_match_numba is None, "numba is not installed")
+class TestBestMatch(unittest.TestCase):
+    def _quantize(self, embeddings):
+        embeddings = embeddings / np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        scales = (np.abs(embeddings).max(axis=-1) / 127.0).astype(np.float32)
+        return np.round(embeddings / scales[:, None]).astype(np.int8), scales
+
+    def test_numba_matches_numpy(self):
+        rng = np.random.default_rng(2023)
+        for num_entries in [1, 7, 256]:
+            embeddings, scales = self._quantize(rng.standard_normal((num_entries, 384)).astype(np.float32))
+            query_embs, query_scales = self._quantize(rng.standard_normal((4, 384)).astype(np.float32))
+            for query_emb, query_scale in zip(query_embs, query_scales):
+                numpy_idx, numpy_sim = best_match_numpy(embeddings, scales, query_emb, query_scale)
+                numba_idx, numba_sim = best_match_numba(embeddings, scales, query_emb, query_scale)
+                self.assertEqual(int(numba_idx), numpy_idx)
+                self.assertAlmostEqual(float(numba_sim), float(numpy_sim), places=5)
+
+    def test_opposite_query_still_matches(self):
+        # a single entry pointing the other way has similarity close to -1 and must still be returned
+        embeddings, scales = self._quantize(np.ones((1, 8), dtype=np.float32))
+        query_emb, query_scale = self._quantize(-np.ones((1, 8), dtype=np.float32))
+        numba_idx, numba_sim = best_match_numba(embeddings, scales, query_emb[0], query_scale[0])
+        self.assertEqual(int(numba_idx), 0)
+        self.assertAlmostEqual(float(numba_sim), -1.0, places=5)
+
+
+if __name__ == "__main__":
+    unittest.main()
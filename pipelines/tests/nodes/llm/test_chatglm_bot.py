@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import time
 import unittest
+from unittest.mock import MagicMock, patch
 
 from pipelines.nodes.llm import ChatGLMBot
 
@@ -31,3 +34,71 @@ class TestChatGLMBot(unittest.TestCase):
             result,
             expected_output,
         )
+
+
+class TestChatGLMBotBatching(unittest.TestCase):
+    @patch("pipelines.nodes.llm.chatglm.Taskflow")
+    def test_concurrent_predict_merged(self, mock_taskflow):
+        first_call_started = threading.Event()
+        release_first_call = threading.Event()
+
+        def generate(queries):
+            if not first_call_started.is_set():
+                first_call_started.set()
+                release_first_call.wait()
+            return {"result": [query + "!" for query in queries]}
+
+        predictor = MagicMock(side_effect=generate)
+        mock_taskflow.return_value = predictor
+        num_queries = 4
+        chatbot = ChatGLMBot(
+            model_name_or_path="__internal_testing__/tiny-random-chatglm",
+            max_batch_size=num_queries - 1,
+            batch_wait_timeout=5,
+        )
+
+        queries = ["query_{}".format(i) for i in range(num_queries)]
+        results = [None] * num_queries
+
+        def predict(index):
+            results[index] = chatbot.predict(queries[index])
+
+        threads = [threading.Thread(target=predict, args=(i,)) for i in range(num_queries)]
+        # The first query finds the predictor idle and runs alone, the others arrive while it is busy
+        threads[0].start()
+        first_call_started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while chatbot.chatglm._num_inflight < num_queries:
+            time.sleep(0.001)
+        release_first_call.set()
+        for thread in threads:
+            thread.join()
+        chatbot.close()
+
+        self.assertEqual(predictor.call_count, 2)
+        self.assertEqual(predictor.call_args_list[0].args[0], queries[:1])
+        self.assertCountEqual(predictor.call_args_list[1].args[0], queries[1:])
+        for query, result in zip(queries, results):
+            self.assertEqual(result, {"result": [query + "!"]})
+
+    @patch("pipelines.nodes.llm.chatglm.Taskflow")
+    def test_single_predict_skips_batch_wait(self, mock_taskflow):
+        predictor = MagicMock(side_effect=lambda queries: {"result": [query + "!" for query in queries]})
+        mock_taskflow.return_value = predictor
+        chatbot = ChatGLMBot(
+            model_name_or_path="__internal_testing__/tiny-random-chatglm",
+            max_batch_size=4,
+            batch_wait_timeout=5,
+        )
+        self.assertEqual(mock_taskflow.call_args.kwargs["batch_size"], 4)
+        start = time.monotonic()
+        result = chatbot.predict("query")
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(result, {"result": ["query!"]})
+        self.assertIsNone(chatbot.chatglm._batch_worker)
+
+        shared = chatbot.chatglm
+        chatbot.close()
+        with self.assertRaises(RuntimeError):
+            shared.submit("query")